@@ -18,37 +18,156 @@
 #
 #===============================================================================
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import itertools
 import json
-import multiprocessing
-import multiprocessing.connection
+import os
+import resource
 import subprocess
-import tempfile
+import sys
+import time
 
 #===============================================================================
 
 from src.drawml import GeoJsonExtractor
-from src.mbtiles import TileDatabase
+from src.drawml.geojson_extractor import write_geojson_seq
+from src.drawml.flatten import DEFAULT_FLATTEN_TOLERANCE
+from src.drawml.simplify import DEFAULT_SIMPLIFY_TOLERANCE, SIMPLIFIERS
+from src.mbtiles import MBTiles
+from src.mvt import MAX_ZOOM, VectorTiler
+from src.spatial_index import SpatialIndex
 from src.styling import Style
 
 #===============================================================================
 
-def process_slide(extractor, slide_number, output_file, result_queue):
-    slide = extractor.slide_to_geometry(slide_number, False)
-    slide.save(output_file)
-    result_queue.put((output_file, slide.layer_id, slide.description))
+VERSION = '0.2.1'
+
+# Increment when a change to extraction changes the GeoJSON made from a slide,
+# so that layers cached by an earlier version are not reused
+
+CACHE_FORMAT = 2
+
+#===============================================================================
+
+# Each worker process opens the Powerpoint file once
+
+worker_extractor = None
+
+def init_worker(powerpoint, args):
+    global worker_extractor
+    worker_extractor = GeoJsonExtractor(powerpoint, args)
+
+def process_slide(slide_number, cache_file):
+    # A slide's GeoJSON is written straight to its cache file, from where it
+    # is streamed to the tiler, and is only renamed once complete
+    slide = worker_extractor.new_slide_maker(slide_number)
+    boxes = []
+    def indexed_features():
+        for feature in slide.features():
+            # Simplified copies of a feature for lower zoom levels have a `max_zoom`
+            if feature.max_zoom is None and feature.bbox is not None:
+                boxes.append([[slide.layer_id, feature.id], feature.bbox])
+            yield feature
+    partial_file = '{}.partial'.format(cache_file)
+    with open(partial_file, 'w') as output:
+        write_geojson_seq(slide.geometry, output, slide.layer_id, indexed_features())
+    os.replace(partial_file, cache_file)
+    return (slide_number, boxes, slide.layer_id, slide.description, slide.statistics)
+
+#===============================================================================
+
+class BuildManifest(object):
+    """
+    Slide hashes and layer details from the previous build of a map, so
+    that GeoJSON and feature boxes cached from unchanged slides can be reused.
+    """
+    def __init__(self, map_dir, options, force=False):
+        self._manifest_file = os.path.join(map_dir, 'manifest.json')
+        self._cache_dir = os.path.join(map_dir, 'geojson')
+        self._options = options
+        self._slides = {}
+        self._previous = {}
+        if not os.path.exists(self._cache_dir):
+            os.makedirs(self._cache_dir)
+        if not force and os.path.exists(self._manifest_file):
+            with open(self._manifest_file) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get('options') == options:
+                self._previous = manifest.get('slides', {})
+
+    def cache_file(self, slide_number):
+        return os.path.join(self._cache_dir, 'slide{:02d}.json'.format(slide_number))
+
+    def boxes_file(self, slide_number):
+        return os.path.join(self._cache_dir, 'slide{:02d}.boxes.json'.format(slide_number))
+
+    def cached(self, slide_number, slide_hash):
+        # Returns the layer details of an unchanged slide, otherwise None
+        previous = self._previous.get(str(slide_number))
+        if (previous is not None and previous['hash'] == slide_hash
+        and os.path.exists(self.cache_file(slide_number))
+        and os.path.exists(self.boxes_file(slide_number))):
+            self._slides[str(slide_number)] = previous
+            return previous
+        return None
+
+    def up_to_date(self, slide_numbers):
+        # All slides are unchanged and none have been removed
+        return set(self._previous) == set(self._slides) == set(str(n) for n in slide_numbers)
+
+    def update(self, slide_number, slide_hash, layer_id, description):
+        self._slides[str(slide_number)] = {
+            'hash': slide_hash,
+            'layer': layer_id,
+            'description': description
+        }
+
+    def save(self):
+        with open(self._manifest_file, 'w') as manifest_file:
+            json.dump({'options': self._options, 'slides': self._slides}, manifest_file, indent=4)
+        cache_files = ([os.path.basename(self.cache_file(int(n))) for n in self._slides]
+                     + [os.path.basename(self.boxes_file(int(n))) for n in self._slides])
+        for filename in os.listdir(self._cache_dir):
+            if filename not in cache_files:
+                os.remove(os.path.join(self._cache_dir, filename))
+
+#===============================================================================
+
+def peak_rss_mb(who):
+    # `ru_maxrss` is in bytes on macOS and kilobytes elsewhere
+    rss = resource.getrusage(who).ru_maxrss
+    return rss/(1024*1024) if sys.platform == 'darwin' else rss/1024
 
 #===============================================================================
 
 if __name__ == '__main__':
     import argparse
-    import os, sys
 
     parser = argparse.ArgumentParser(description='Convert Powerpoint slides to a flatmap.')
     parser.add_argument('--debug-xml', action='store_true',
                         help="save a slide's DrawML for debugging")
+    parser.add_argument('--flatten-tolerance', type=float, metavar='WORLD_UNITS',
+                        default=DEFAULT_FLATTEN_TOLERANCE,
+                        help='maximum deviation of flattened curves (default {})'
+                             .format(DEFAULT_FLATTEN_TOLERANCE))
+    parser.add_argument('--force', action='store_true',
+                        help='extract all slides, even if they are unchanged since the last build')
+    parser.add_argument('--jobs', type=int, metavar='N', default=os.cpu_count(),
+                        help='number of slides to extract in parallel (default {})'
+                             .format(os.cpu_count()))
+    parser.add_argument('--max-zoom', type=int, metavar='N', default=MAX_ZOOM,
+                        help='maximum zoom level of vector tiles (default {})'.format(MAX_ZOOM))
+    parser.add_argument('--simplify', choices=list(SIMPLIFIERS),
+                        help='simplify features for bands of zoom levels when they are extracted')
+    parser.add_argument('--simplify-tolerance', type=float, metavar='TILE_UNITS',
+                        default=DEFAULT_SIMPLIFY_TOLERANCE,
+                        help='maximum deviation of simplified features at the highest zoom of a band (default {})'
+                             .format(DEFAULT_SIMPLIFY_TOLERANCE))
     parser.add_argument('--slide', type=int, metavar='N',
                         help='only process this slide number (1-origin)')
-    parser.add_argument('--version', action='version', version='0.2.1')
+    parser.add_argument('--tiler', choices=['tippecanoe', 'native'], default='tippecanoe',
+                        help='how to generate vector tiles (default `tippecanoe`)')
+    parser.add_argument('--version', action='version', version=VERSION)
 
 
     base_url = 'http://localhost:8000'
@@ -63,7 +182,6 @@ if __name__ == '__main__':
     ## --background
     ##
     ## specify range of slides...
-    # --force option
 
     args = parser.parse_args()
 
@@ -75,54 +193,114 @@ if __name__ == '__main__':
         os.makedirs(map_dir)
 
     print('Extracting layers...')
-    filenames = []
-    processes = []
+    start_time = time.time()
     map_extractor = GeoJsonExtractor(args.powerpoint, args)
-    result_queue = multiprocessing.Queue()
-    for s in range(2, len(map_extractor)+1):  # First slide is background layer
-        (fh, filename) = tempfile.mkstemp(suffix='.json')
-        os.close(fh)
-        filenames.append(filename)
-
-        # We extract slides in parallel...
-
-        process = multiprocessing.Process(target=process_slide, args=(map_extractor, s, filename, result_queue))
-        processes.append(process)
-        process.start()
-
-    # Get layer details from each process
-
-    num_processes = len(processes)
-    if num_processes == 0:
+    num_slides = len(map_extractor)
+    if num_slides < 2:   # First slide is background layer
         sys.exit('No map layers in Powerpoint...')
 
-    tippe_inputs = []
-    while num_processes:
-        (filename, layer_id, description) = result_queue.get()
-        print('Processed layer {}: {}'.format(layer_id, description))
-        tippe_inputs.append({
-            'file': filename,
-            'layer': layer_id,
-            'description': description
-            })
-        num_processes -= 1
-
-    # Wait for all processes to complete
-
-    for process in processes:
-        process.join()
-
-    # Generate Mapbox vector tiles
-
-    print('Running tippecanoe...')
-    subprocess.run(['tippecanoe', '--projection=EPSG:4326', '--force',
-                    # No compression results in a smaller `mbtiles` file
-                    # and is also required to serve tile directories
-                    '--no-tile-compression',
-                    '--output={}'.format(mbtiles_file),
-                    ]
-                    + list(["-L{}".format(json.dumps(input)) for input in tippe_inputs])
-                   )
+    # Only extract slides that have changed since the last build
+
+    manifest = BuildManifest(map_dir, {'version': VERSION,
+                                       'cache_format': CACHE_FORMAT,
+                                       'flatten_tolerance': args.flatten_tolerance,
+                                       'max_zoom': args.max_zoom,
+                                       'simplify': args.simplify,
+                                       'simplify_tolerance': args.simplify_tolerance,
+                                       'tiler': args.tiler}, args.force)
+    slide_hashes = {}
+    layer_descriptions = {}
+    cached_slides = []
+    for s in range(2, num_slides+1):
+        slide_hashes[s] = map_extractor.slide_hash(s)
+        cached = manifest.cached(s, slide_hashes[s])
+        if cached is not None:
+            print('Unchanged layer {}: {}'.format(cached['layer'], cached['description']))
+            layer_descriptions[cached['layer']] = cached['description']
+            cached_slides.append(s)
+
+    # The manifest is saved last, so a build that failed part way is redone
+
+    if (manifest.up_to_date(range(2, num_slides+1))
+    and all(os.path.exists(os.path.join(map_dir, filename))
+                for filename in ['index.mbtiles', 'spatial_index.json', 'index.json'])):
+        print('Map is up to date...')
+        sys.exit()
+
+    # Features are streamed to the tiler as newline-delimited GeoJSON, with
+    # each feature naming its layer
+
+    if args.tiler == 'native':
+        tippecanoe = None
+        tiler = VectorTiler(max_zoom=args.max_zoom)
+        tiler_input = tiler
+    else:
+        tippecanoe = subprocess.Popen(['tippecanoe', '--projection=EPSG:4326', '--force',
+                                       # No compression results in a smaller `mbtiles` file
+                                       # and is also required to serve tile directories
+                                       '--no-tile-compression',
+                                       '--maximum-zoom={}'.format(args.max_zoom),
+                                       '--output={}'.format(mbtiles_file),
+                                      ],
+                                      stdin=subprocess.PIPE)
+        tiler_input = tippecanoe.stdin
+    try:
+        with ProcessPoolExecutor(max_workers=max(1, args.jobs),
+                                 initializer=init_worker,
+                                 initargs=(args.powerpoint, args)) as executor:
+            futures = [executor.submit(process_slide, s, manifest.cache_file(s))
+                            for s in range(2, num_slides+1) if s not in cached_slides]
+
+            # Layers are streamed from their cache files in slide order,
+            # whatever order they finish in
+
+            completed = set(cached_slides)
+            feature_boxes = []
+            next_slide = 2
+            for future in itertools.chain([None], as_completed(futures)):
+                if future is not None:
+                    (slide_number, boxes, layer_id, description, statistics) = future.result()
+                    print('Processed layer {}: {} ({})'.format(layer_id, description, statistics))
+                    layer_descriptions[layer_id] = description
+                    with open(manifest.boxes_file(slide_number), 'w') as boxes_file:
+                        json.dump(boxes, boxes_file)
+                    manifest.update(slide_number, slide_hashes[slide_number], layer_id, description)
+                    completed.add(slide_number)
+                while next_slide in completed:
+                    completed.remove(next_slide)
+                    with open(manifest.cache_file(next_slide), 'rb') as cache_file:
+                        for line in cache_file:
+                            tiler_input.write(line)
+                    with open(manifest.boxes_file(next_slide)) as boxes_file:
+                        feature_boxes.extend(json.load(boxes_file))
+                    next_slide += 1
+    except BaseException:
+        if tippecanoe is not None:
+            tippecanoe.kill()
+        raise
+
+    print('Extracted {} layers in {:.1f}s (peak RSS {:.0f} MB, workers {:.0f} MB)'
+          .format(len(futures), time.time() - start_time,
+                  peak_rss_mb(resource.RUSAGE_SELF), peak_rss_mb(resource.RUSAGE_CHILDREN)))
+
+    # Wait for Mapbox vector tiles to be generated
+
+    if tippecanoe is None:
+        print('Making vector tiles...')
+        start_time = time.time()
+        tile_count = tiler.make_mbtiles(mbtiles_file, max(1, args.jobs))
+        print('Made {} tiles in {:.1f}s'.format(tile_count, time.time() - start_time))
+    else:
+        print('Running tippecanoe...')
+        tippecanoe.stdin.close()
+        if tippecanoe.wait() != 0:
+            sys.exit('tippecanoe failed...')
+
+    # Index features by their bounding boxes, for lookup by position
+
+    spatial_index = SpatialIndex([box for (id, box) in feature_boxes],
+                                 [tuple(id) for (id, box) in feature_boxes])
+    spatial_index.save(os.path.join(map_dir, 'spatial_index.json'))
 
     # Set our map's actual bounds and centre (`tippecanoe` uses bounding box
     # containing all features, which is not full map area)
@@ -131,12 +309,19 @@ if __name__ == '__main__':
     map_centre = [(bounds[0]+bounds[2])/2, (bounds[1]+bounds[3])/2]
     map_bounds = [bounds[0], bounds[3], bounds[2], bounds[1]]   # southwest and northeast ccorners
 
-    tile_db = TileDatabase(mbtiles_file)
-    tile_db.execute("UPDATE metadata SET value='{}' WHERE name = 'center'"
-                    .format(','.join([str(x) for x in map_centre])))
-    tile_db.execute("UPDATE metadata SET value='{}' WHERE name = 'bounds'"
-                    .format(','.join([str(x) for x in map_bounds])))
-    tile_db.execute("COMMIT")
+    tile_db = MBTiles(mbtiles_file)
+    tile_db.update_metadata({
+        'center': ','.join([str(x) for x in map_centre]),
+        'bounds': ','.join([str(x) for x in map_bounds])
+    })
+
+    # Layers were named by their features so now add their descriptions
+
+    layer_json = json.loads(tile_db.metadata()['json'])
+    for layer in layer_json['vector_layers']:
+        layer['description'] = layer_descriptions.get(layer['id'], '')
+    tile_db.update_metadata({'json': json.dumps(layer_json)})
+    tile_db.commit()
 
     # Create style file
 
@@ -147,15 +332,11 @@ if __name__ == '__main__':
     style_dict = Style.style('{}/{}'.format(base_url, args.map_id),
                              tile_db.metadata(),
                              background_image)   ## args.background
-
+    tile_db.close()
 
     with open(os.path.join(map_dir, 'index.json'), 'w') as output_file:
         json.dump(style_dict, output_file)
 
-    # Tidy up
-
-    print('Cleaning up...')
-    for filename in filenames:
-        os.remove(filename)
+    manifest.save()
 
 #===============================================================================
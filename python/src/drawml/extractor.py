@@ -18,6 +18,7 @@
 #
 #===============================================================================
 
+import hashlib
 from math import sqrt, sin, cos, pi as PI
 import os
 
@@ -74,26 +75,45 @@ class Transform(object):
         theta = xfrm.rot*PI/180.0
         Fx = -1 if xfrm.flipH else 1
         Fy = -1 if xfrm.flipV else 1
-        T_st = np.matrix([[Dx_/Dx,      0, Bx_ - (Dx_/Dx)*Bx] if Dx != 0 else [1, 0, Bx_],
-                          [     0, Dy_/Dy, By_ - (Dy_/Dy)*By] if Dy != 0 else [0, 1, By_],
-                          [     0,      0,                 1]])
-        U = np.matrix([[1, 0, -(Bx_ + Dx_/2.0)],
-                       [0, 1, -(By_ + Dy_/2.0)],
-                       [0, 0,                1]])
-        R = np.matrix([[cos(theta), -sin(theta), 0],
-                       [sin(theta),  cos(theta), 0],
-                       [0,                    0, 1]])
-        Flip = np.matrix([[Fx,  0, 0],
-                          [ 0, Fy, 0],
-                          [ 0,  0, 1]])
-        T_rf = U.I*R*Flip*U
-        self._T = T_rf*T_st
+        T_st = np.array([[Dx_/Dx,      0, Bx_ - (Dx_/Dx)*Bx] if Dx != 0 else [1, 0, Bx_],
+                         [     0, Dy_/Dy, By_ - (Dy_/Dy)*By] if Dy != 0 else [0, 1, By_],
+                         [     0,      0,                 1]])
+        U = np.array([[1, 0, -(Bx_ + Dx_/2.0)],
+                      [0, 1, -(By_ + Dy_/2.0)],
+                      [0, 0,                1]])
+        R = np.array([[cos(theta), -sin(theta), 0],
+                      [sin(theta),  cos(theta), 0],
+                      [0,                    0, 1]])
+        Flip = np.array([[Fx,  0, 0],
+                         [ 0, Fy, 0],
+                         [ 0,  0, 1]])
+        T_rf = np.linalg.inv(U)@R@Flip@U
+        self._T = T_rf@T_st
 
     def matrix(self):
         return self._T
 
 #===============================================================================
 
+def find_layer_details(shapes):
+#==============================
+    """
+    Find the ``#layer-id`` text box in a shape list, so that a slide's layer
+    is known before any of its shapes are processed.
+    """
+    for shape in shapes:
+        if shape.shape_type == MSO_SHAPE_TYPE.TEXT_BOX:
+            attribs = shape.name.split()
+            if len(attribs) > 1 and attribs[0] == '#layer-id':
+                return (attribs[1], shape.text)
+        elif shape.shape_type == MSO_SHAPE_TYPE.GROUP:
+            details = find_layer_details(shape.shapes)
+            if details is not None:
+                return details
+    return None
+
+#===============================================================================
+
 class ProcessSlide(object):
     def __init__(self, slide, slide_number, args):
         self._slide = slide
@@ -102,6 +122,11 @@ class ProcessSlide(object):
         self._layer_id = 'slide{:02d}'.format(slide_number)
         self._description = 'Slide {:02d}'.format(slide_number)
         self._shape_name_ids = []
+        layer_details = find_layer_details(slide.shapes)
+        if layer_details is not None:
+            self._layer_id = layer_details[0]
+            if layer_details[1] != '':
+                self._description = layer_details[1]
 
     @property
     def args(self):
@@ -131,11 +156,24 @@ class ProcessSlide(object):
         # Override in sub-class
         pass
 
+    @property
+    def statistics(self):
+        # Override in sub-class
+        return None
+
     def save(self, filename=None):
         # Override in sub-class
         pass
 
     def process_shape_list(self, shapes, *args):
+        for _ in self.iterate_shape_list(shapes, *args):
+            pass
+
+    def iterate_shape_list(self, shapes, *args):
+        """
+        Process a list of shapes, generating whatever items `process_shape()`
+        and `process_group()` generate.
+        """
         for shape in shapes:
             shape.name_id = ''
             shape.name_attributes = []
@@ -153,9 +191,9 @@ class ProcessSlide(object):
              or shape.shape_type == MSO_SHAPE_TYPE.FREEFORM
              or shape.shape_type == MSO_SHAPE_TYPE.PICTURE
              or isinstance(shape, pptx.shapes.connector.Connector)):
-                self.process_shape(shape, *args)
+                yield from self.process_shape(shape, *args) or ()
             elif shape.shape_type == MSO_SHAPE_TYPE.GROUP:
-                self.process_group(shape, *args)
+                yield from self.process_group(shape, *args) or ()
             elif shape.shape_type == MSO_SHAPE_TYPE.TEXT_BOX:
                 if shape.name_id == 'layer-id' and len(shape.name_attributes) > 0:
                     self._layer_id = shape.name_attributes[0]
@@ -192,17 +230,36 @@ class GeometryExtractor(object):
     def slide(self, slide_number):
         return self._slides[slide_number - 1]
 
-    def slide_to_geometry(self, slide_number, save_output=True):
+    def slide_hash(self, slide_number):
+        """
+        A hash of a slide's XML along with that of its layout and master,
+        and the size of the presentation's slides, which sets the scale of
+        their geometry.
+        """
+        slide = self.slide(slide_number)
+        layout = slide.slide_layout
+        sha = hashlib.sha256('{}x{}'.format(*self._slide_size).encode('ascii'))
+        for part in [slide.part, layout.part, layout.slide_master.part]:
+            sha.update(part.blob)
+        return sha.hexdigest()
+
+    def new_slide_maker(self, slide_number):
         slide = self.slide(slide_number)
         if self._args.debug_xml:
             xml = open(os.path.join(self._args.output_dir, 'slide{:02d}.xml'.format(slide_number)), 'w')
             xml.write(slide.element.xml)
             xml.close()
         if self._SlideMaker is not None:
-            self._slide_maker = self._SlideMaker(self, slide, slide_number, self._args)
+            return self._SlideMaker(self, slide, slide_number, self._args)
+
+    def slide_to_geometry(self, slide_number, save_output=True):
+        self._slide_maker = self.new_slide_maker(slide_number)
+        if self._slide_maker is not None:
             self._slide_maker.process()
             if save_output:
                 self._slide_maker.save()
+                if self._slide_maker.statistics is not None:
+                    print('Slide {}: {}'.format(slide_number, self._slide_maker.statistics))
             else:
                 return self._slide_maker
 
@@ -0,0 +1,96 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""Flatten Bézier curves into polylines to within a given tolerance."""
+
+#===============================================================================
+
+import numpy as np
+
+#===============================================================================
+
+# Maximum deviation, in world units, of a flattened curve from the true curve
+
+DEFAULT_FLATTEN_TOLERANCE = 5.0
+
+MAX_SUBDIVISION_DEPTH = 16
+
+#===============================================================================
+
+def quadratic_to_cubic(p0, p1, p2):
+#==================================
+    return (p0, (p0[0] + 2*(p1[0] - p0[0])/3, p0[1] + 2*(p1[1] - p0[1])/3),
+                (p2[0] + 2*(p1[0] - p2[0])/3, p2[1] + 2*(p1[1] - p2[1])/3), p2)
+
+def is_flat(curves, tolerance):
+#==============================
+    # The distance between a cubic and its chord is bounded by 3/4 of the
+    # largest second difference of its control points.
+    dd1 = curves[:, 0] - 2*curves[:, 1] + curves[:, 2]
+    dd2 = curves[:, 1] - 2*curves[:, 2] + curves[:, 3]
+    deviation = 0.75*np.sqrt(np.maximum((dd1**2).sum(axis=1), (dd2**2).sum(axis=1)))
+    return deviation <= tolerance
+
+def split_in_half(curves):
+#=========================
+    p01 = (curves[:, 0] + curves[:, 1])/2
+    p12 = (curves[:, 1] + curves[:, 2])/2
+    p23 = (curves[:, 2] + curves[:, 3])/2
+    p012 = (p01 + p12)/2
+    p123 = (p12 + p23)/2
+    p0123 = (p012 + p123)/2
+    return (np.stack((curves[:, 0], p01, p012, p0123), axis=1),
+            np.stack((p0123, p123, p23, curves[:, 3]), axis=1))
+
+def flatten_cubics(curves, tolerance):
+#=====================================
+    """
+    Adaptively subdivide an (M, 4, 2) array of cubic Bézier control points
+    until each piece is within ``tolerance`` of its chord.
+
+    All curves are subdivided together, one level at a time. Returns a list
+    with an (N, 2) array of polyline points for each curve, starting at the
+    curve's first point and ending at its last.
+    """
+    curves = np.asarray(curves, dtype=np.float64).reshape((-1, 4, 2))
+    count = len(curves)
+    if count == 0:
+        return []
+    origin = np.arange(count)
+    done = np.zeros(count, dtype=bool)
+    for depth in range(MAX_SUBDIVISION_DEPTH):
+        split = ~done
+        split[split] = ~is_flat(curves[split], tolerance)
+        if not split.any():
+            break
+        pieces = np.where(split, 2, 1)
+        index = np.repeat(np.arange(len(curves)), pieces)
+        first = (np.cumsum(pieces) - pieces)[split]
+        (left, right) = split_in_half(curves[split])
+        curves = curves[index]
+        curves[first] = left
+        curves[first + 1] = right
+        origin = origin[index]
+        done = np.repeat(~split, pieces)
+    ends = np.split(curves[:, 3], np.cumsum(np.bincount(origin, minlength=count))[:-1])
+    starts = curves[np.searchsorted(origin, np.arange(count)), 0]
+    return [np.vstack((start, end)) for (start, end) in zip(starts, ends)]
+
+#===============================================================================
@@ -22,6 +22,7 @@
 
 #===============================================================================
 
+import functools
 import math
 
 import pptx.shapes.connector
@@ -80,97 +81,230 @@ PRESET_VARIABLES = {
     "ssd32": "*/ ss 1.0 32.0",  # 1/32 Shortest Side of Shape
 }
 
+# Compiled formulae are shared by shapes, with freeform shapes able to add
+# any number of their own
+
+COMPILE_CACHE_SIZE = 4096
+
 #===============================================================================
 
 class Evaluator(object):
 
+    # Formulae are applied to already evaluated arguments
     formulae = {
-        "*/": lambda v, x, y, z: v(x) * v(y) / v(z),  # Multiply Divide Formula
-        "+-": lambda v, x, y, z: v(x) + v(y) - v(z),  # Add Subtract Formula
-        "+/": lambda v, x, y, z: (v(x) + v(y)) / v(z),  # Add Divide Formula
-        "?:": lambda v, x, y, z: v(y) if v(x) > 0 else v(z),  # If Else Formula
-        "at2": lambda v, x, y: (  # ArcTan Formula
-            st_angle(math.atan(v(y) / v(x)))
-            if v(x) != 0.0
-            else v("cd4" if v(y) >= 0 else "3cd4")
+        "*/": lambda x, y, z: x * y / z,  # Multiply Divide Formula
+        "+-": lambda x, y, z: x + y - z,  # Add Subtract Formula
+        "+/": lambda x, y, z: (x + y) / z,  # Add Divide Formula
+        "?:": lambda x, y, z: y if x > 0 else z,  # If Else Formula
+        "at2": lambda x, y: (  # ArcTan Formula
+            st_angle(math.atan(y / x))
+            if x != 0.0
+            else PRESET_VARIABLES["cd4" if y >= 0 else "3cd4"]
         ),
-        "tan": lambda v, x, y: v(x) * math.tan(radians(v(y))),  # Tangent Formula
-        "cat2": lambda v, x, y, z: (  # Cosine ArcTan Formula
-            v(x)
-            * math.cos(math.atan(v(z) / v(y)))
-            if v(y) != 0.0
+        "tan": lambda x, y: x * math.tan(radians(y)),  # Tangent Formula
+        "cat2": lambda x, y, z: (  # Cosine ArcTan Formula
+            x
+            * math.cos(math.atan(z / y))
+            if y != 0.0
             else 0.0
         ),
-        "cos": lambda v, x, y: v(x) * math.cos(radians(v(y))),  # Cosine Formula
-        "sat2": lambda v, x, y, z: (  # Sine ArcTan Formula
-            v(x)
-            * math.sin(math.atan(v(z) / v(y)))
-            if v(y) != 0.0
-            else v(x)
-            if v(z) >= 0
-            else -v(x)
+        "cos": lambda x, y: x * math.cos(radians(y)),  # Cosine Formula
+        "sat2": lambda x, y, z: (  # Sine ArcTan Formula
+            x
+            * math.sin(math.atan(z / y))
+            if y != 0.0
+            else x
+            if z >= 0
+            else -x
         ),
-        "sin": lambda v, x, y: v(x) * math.sin(radians(v(y))),  # Sine Formula
-        "mod": lambda v, x, y, z: math.sqrt(
-            v(x) ** 2 + v(y) ** 2 + v(z) ** 2
+        "sin": lambda x, y: x * math.sin(radians(y)),  # Sine Formula
+        "mod": lambda x, y, z: math.sqrt(
+            x ** 2 + y ** 2 + z ** 2
         ),  # Modulo Formula
-        "sqrt": lambda v, x: math.sqrt(v(x)),  # Square Root Formula
-        "val": lambda v, x: v(x),  # Literal Value Formula
-        "abs": lambda v, x: abs(v(x)),  # Absolute Value Formula
-        "max": lambda v, x, y: max(v(x), v(y)),  # Maximum Value Formula
-        "min": lambda v, x, y: min(v(x), v(y)),  # Minimum Value Formula
-        "pin": lambda v, x, y, z: (
-            v(x)
-            if v(y) < v(x)  # Pin To Formula
-            else v(z)
-            if v(y) > v(z)
-            else v(y)
+        "sqrt": lambda x: math.sqrt(x),  # Square Root Formula
+        "val": lambda x: x,  # Literal Value Formula
+        "abs": lambda x: abs(x),  # Absolute Value Formula
+        "max": lambda x, y: max(x, y),  # Maximum Value Formula
+        "min": lambda x, y: min(x, y),  # Minimum Value Formula
+        "pin": lambda x, y, z: (
+            x
+            if y < x  # Pin To Formula
+            else z
+            if y > z
+            else y
         ),
     }
 
     @staticmethod
-    def evaluate(expr, context):
+    @functools.lru_cache(maxsize=COMPILE_CACHE_SIZE)
+    def compile(expr):
+        """
+        Compile a formula into a closure over a dictionary of evaluated
+        guide values. Returns the closure and the guide names it references.
+        """
         args = expr.split()
-        return Evaluator.formulae[args[0]](context.evaluate, *args[1:])
+        if len(args) == 1:
+            if is_number(args[0]):
+                return (constant(float(args[0])), ())
+            return (variable(args[0]), (args[0],))
+        formula = Evaluator.formulae[args[0]]
+        operands = [operand(arg) for arg in args[1:]]
+        references = tuple(arg for arg in args[1:] if not is_number(arg))
+        def evaluate(values):
+            return formula(*[op(values) for op in operands])
+        return (evaluate, references)
+
+    @staticmethod
+    def evaluate(expr, values):
+        return Evaluator.compile(expr)[0](values)
+
+#===============================================================================
+
+def is_number(x):
+    try:
+        float(x)
+        return True
+    except ValueError:
+        return False
+
+def constant(x):
+    return lambda values: x
+
+def variable(name):
+    return lambda values: values[name]
+
+def operand(arg):
+    return constant(float(arg)) if is_number(arg) else variable(arg)
+
+#===============================================================================
+
+def compile_guides(guides, excluded=()):
+    """
+    Order guide formulae, given as ``(name, formula)`` pairs in document
+    order, for evaluation, returning a list of ``(name, closure)`` pairs.
+
+    A guide may be redefined, with references to it from the guides that
+    follow being to its new value. Guides are kept in document order, except
+    that one referencing a guide only defined later is moved after it.
+    """
+    definitions = [(name, Evaluator.compile(str(fmla))) for (name, fmla) in guides
+                        if name not in excluded]
+    first = {}
+    for (index, (name, _)) in enumerate(definitions):
+        first.setdefault(name, index)
+    # Bind each reference to the latest definition before it, or else to
+    # the first definition after it
+    depends = []
+    readers = {}
+    latest = {}
+    for (index, (name, (_, references))) in enumerate(definitions):
+        bound = [latest.get(ref, first.get(ref)) for ref in references]
+        depends.append([i for i in bound if i is not None and i != index])
+        for i in depends[-1]:
+            readers.setdefault(i, []).append(index)
+        latest[name] = index
+    # A redefinition follows the definition it replaces and all its readers
+    latest = {}
+    for (index, (name, _)) in enumerate(definitions):
+        if name in latest:
+            replaced = latest[name]
+            depends[index].append(replaced)
+            depends[index].extend(i for i in readers.get(replaced, []) if i != index)
+        latest[name] = index
+    ordered = []
+    state = {}
+    def visit(index):
+        if state.get(index) == 'done':
+            return
+        if state.get(index) == 'visiting':
+            raise ValueError('Circular reference to guide {}'.format(definitions[index][0]))
+        state[index] = 'visiting'
+        for i in depends[index]:
+            visit(i)
+        state[index] = 'done'
+        ordered.append((definitions[index][0], definitions[index][1][0]))
+    for index in range(len(definitions)):
+        visit(index)
+    return ordered
+
+PRESET_GUIDES = compile_guides(PRESET_VARIABLES.items())
 
 #===============================================================================
 
 class Geometry(object):
+
+    # Compiled guide lists are shared by all shapes with the same preset
+    compiled_presets_ = {}
+
     def __init__(self, shape):
         self._xfrm = shape.element.xfrm
 
         if shape.shape_type == MSO_SHAPE_TYPE.AUTO_SHAPE:
-            self._geometry = Shapes.lookup(shape.element.prstGeom.attrib['prst'])
+            preset = shape.element.prstGeom.attrib['prst']
             adjustments = shape.element.prstGeom.avLst
 
         elif shape.shape_type == MSO_SHAPE_TYPE.FREEFORM:
+            preset = None
             self._geometry = shape.element.spPr.custGeom
             adjustments = None
 
         elif (shape.shape_type == MSO_SHAPE_TYPE.PICTURE
            or isinstance(shape, pptx.shapes.connector.Connector)):
-            self._geometry = Shapes.lookup(shape.element.spPr.prstGeom.attrib['prst'])
+            preset = shape.element.spPr.prstGeom.attrib['prst']
             adjustments = None
 
         else:
             print('Unknown geometry for', shape.shape_type)
 
-        self._variables = {
-            'w': shape.width,
-            'h': shape.height
-        }
-
-        if self._geometry.gdLst is not None:
-            for gd in self._geometry.gdLst:
-                self._variables[gd.name] = gd.fmla
-
-        if self._geometry.avLst is not None:
-            for gd in self._geometry.avLst:
-                self._variables[gd.name] = gd.fmla
+        if preset is not None:
+            self._geometry = Shapes.lookup(preset)
+            guides = Geometry.compiled_presets_.get(preset)
+            if guides is None:
+                guides = Geometry.compile(self._geometry)
+                Geometry.compiled_presets_[preset] = guides
+        else:
+            guides = Geometry.compile(self._geometry)
 
+        overrides = {}
         if adjustments is not None:
             for gd in adjustments:
-                self._variables[gd.name] = gd.fmla
+                overrides[gd.name] = Evaluator.compile(gd.fmla)[0]
+
+        self._values = {
+            'w': float(shape.width),
+            'h': float(shape.height)
+        }
+        self._failures = {}
+        for (name, evaluate) in PRESET_GUIDES:
+            self._values[name] = evaluate(self._values)
+        for (name, evaluate) in overrides.items():
+            if name not in PRESET_VARIABLES:
+                self._evaluate_guide(name, evaluate)
+        for (name, evaluate) in guides:
+            if name not in overrides:
+                self._evaluate_guide(name, evaluate)
+
+    @staticmethod
+    def compile(geometry):
+        # Adjust values come before the guides that use them
+        formulae = []
+        for guide_list in [geometry.avLst, geometry.gdLst]:
+            if guide_list is not None:
+                formulae.extend((gd.name, gd.fmla) for gd in guide_list)
+        return compile_guides(formulae, PRESET_VARIABLES)
+
+    def _evaluate_guide(self, name, evaluate):
+        # Errors are only raised if an unevaluated guide is actually used
+        try:
+            self._values[name] = evaluate(self._values)
+        except (ArithmeticError, KeyError, ValueError) as error:
+            self._failures[name] = self._cause(error)
+
+    def _cause(self, error):
+        # A guide that references a failed guide fails for the same reason
+        if isinstance(error, KeyError) and error.args and error.args[0] in self._failures:
+            return self._failures[error.args[0]]
+        return error
 
     @property
     def path_list(self):
@@ -181,13 +315,14 @@ class Geometry(object):
         return self._xfrm
 
     def evaluate(self, x):
-        try: return float(x)
-        except ValueError: pass
-        try: return self.evaluate(PRESET_VARIABLES[x])
-        except KeyError: pass
-        try: return self.evaluate(self._variables[x])
+        try: return self._values[x]
         except KeyError: pass
-        return Evaluator.evaluate(x, self)
+        if x in self._failures:
+            raise self._failures[x]
+        try:
+            return Evaluator.evaluate(x, self._values)
+        except KeyError as error:
+            raise self._cause(error) from None
 
     def point(self, pt):
         return (self.evaluate(pt.attrib['x']), self.evaluate(pt.attrib['y']))
@@ -21,23 +21,19 @@
 import json
 import math
 import os
+import time
 
 #===============================================================================
 
-# https://simoncozens.github.io/beziers.py/index.html
-from beziers.cubicbezier import CubicBezier
-from beziers.point import Point as BezierPoint
-from beziers.quadraticbezier import QuadraticBezier
-
 import numpy as np
 
 #===============================================================================
 
-from .arc_to_bezier import cubic_beziers_from_arc, tuple2
 from .extractor import GeometryExtractor, ProcessSlide, Transform
-from .extractor import ellipse_point
-from .formula import Geometry, radians
-from .presets import DML
+from .geometry import Feature, GeometryStore
+from .paths import shape_paths
+from .simplify import DEFAULT_MAX_ZOOM, DEFAULT_SIMPLIFY_TOLERANCE, lon_lat_to_mercator
+from .simplify import shared_vertex_counts, simplify, tile_tolerance, topology_anchors, zoom_bands
 
 #===============================================================================
 
@@ -45,7 +41,16 @@ WORLD_PER_EMU = 0.1
 
 def transform_point(transform, point):
     pt = transform.dot([point[0], point[1], 1.0])
-    return (pt[0, 0], pt[0, 1])
+    return (pt[0], pt[1])
+
+def transform_points(transform, points):
+    return points@transform[0:2, 0:2].T + transform[0:2, 2]
+
+def shape_tolerance(tolerance, transform):
+    # Convert a world tolerance into shape units, rounded so that shapes
+    # with the same scale can share flattened paths
+    scale = np.linalg.norm(transform[0:2, 0:2], 2)
+    return float('{:.3g}'.format(tolerance/scale)) if scale > 0 else tolerance
 
 def point_to_lon_lat(point):
     b = 20037508.34
@@ -54,11 +59,10 @@ def point_to_lon_lat(point):
     return (lon*180/b, math.atan(math.exp(lat*math.pi/b))*360/math.pi - 90)
 
 def points_to_lon_lat(points):
-    return [ point_to_lon_lat(pt) for pt in points ]
-
-def transform_bezier_samples(transform, bz):
-    samples = 100
-    return [transform_point(transform, (pt.x, pt.y)) for pt in bz.sample(samples)]
+    b = 20037508.34
+    lon = points[:, 0]*180/b
+    lat = np.arctan(np.exp(points[:, 1]*math.pi/b))*360/math.pi - 90
+    return np.column_stack((lon, lat))
 
 #===============================================================================
 
@@ -66,127 +70,189 @@ class MakeGeoJsonSlide(ProcessSlide):
     def __init__(self, extractor, slide, slide_number, args):
         super().__init__(slide, slide_number, args)
         self._transform = extractor.transform
+        self._tolerance = args.flatten_tolerance
+        self._simplify = getattr(args, 'simplify', None)
+        if self._simplify is not None:
+            # Zoom bands are spread over the levels at which the map is
+            # larger than a tile
+            corners = lon_lat_to_mercator(np.array(extractor.bounds()).reshape((2, 2)))
+            map_size = np.abs(corners[1] - corners[0]).max()
+            self._max_zoom = getattr(args, 'max_zoom', DEFAULT_MAX_ZOOM)
+            self._zoom_bands = zoom_bands(map_size, self._max_zoom)
+            self._simplify_tolerance = getattr(args, 'simplify_tolerance', DEFAULT_SIMPLIFY_TOLERANCE)
+        self._geometry = GeometryStore()
+        self._feature_count = 0
+        self._vertex_count = 0
+        self._process_time = 0
+
+    @property
+    def geometry(self):
+        return self._geometry
+
+    @property
+    def statistics(self):
+        return '{} features, {} vertices, {:.2f}s'.format(self._feature_count,
+                                                         self._vertex_count,
+                                                         self._process_time)
+
+    def features(self):
+        """
+        Generate the slide's features as they are added to its geometry, or,
+        when they are simplified, once all its shapes have been processed.
+        """
+        start_time = time.time()
+        if self._simplify is None:
+            for feature in self.iterate_shape_list(self.slide.shapes, self._transform):
+                self._feature_count += 1
+                yield feature
+        else:
+            # Shared vertices are only known once all shapes are processed
+            self.process_shape_list(self.slide.shapes, self._transform)
+            self._feature_count = len(self._geometry)
+            self._geometry.replace_features(self.zoom_band_features())
+            yield from self._geometry
+        self._process_time = time.time() - start_time
 
     def process(self):
-        self._features = []
-        self.process_shape_list(self.slide.shapes, self._transform)
-        self._feature_collection = {
+        for feature in self.features():
+            pass
+
+    def zoom_band_features(self):
+        """
+        Generate copies of features with geometry simplified for each band
+        of zoom levels, with a band's levels as the copy's ``min_zoom`` and
+        ``max_zoom``. Vertices shared by shapes are kept where needed for
+        their shared edges to be simplified identically.
+
+        A copy is only made when a band's geometry differs from the next
+        higher band's, and features that collapse at lower zooms are
+        omitted there. The copy for the highest band has no ``max_zoom``.
+        """
+        store = self._geometry
+        features = list(store)
+        # Simplify in Web Mercator, where tile units are the same everywhere
+        coordinates = store.coordinates
+        mercator = lon_lat_to_mercator(coordinates)
+        offsets = store.offsets
+        part_points = [mercator[offsets[index]:offsets[index + 1]] for index in range(len(offsets) - 1)]
+        shared_counts = shared_vertex_counts(part_points)
+        for feature in features:
+            polygon = (feature.geometry_type == 'Polygon')
+            lines = [coordinates[offsets[index]:offsets[index + 1]] for index in feature.parts]
+            if sum(len(line) for line in lines) == 0:
+                yield feature
+                continue
+            explicitly_closed = [polygon and len(line) > 1 and (line[0] == line[-1]).all() for line in lines]
+            min_points = [(3 + closed) if polygon else 2 for closed in explicitly_closed]
+            anchors = [topology_anchors(shared_counts[index], polygon) for index in feature.parts]
+            bands = []
+            for (bottom, top) in self._zoom_bands:
+                tolerance = tile_tolerance(self._simplify_tolerance, top)
+                kept = [simplify(part_points[index], tolerance, part_anchors, self._simplify)
+                            for (index, part_anchors) in zip(feature.parts, anchors)]
+                if any(len(indices) < count for (indices, count) in zip(kept, min_points)):
+                    if not bands:
+                        bands.append([None, bottom, top])
+                    break
+                if bands and all(np.array_equal(indices, previous)
+                                    for (indices, previous) in zip(kept, bands[-1][0])):
+                    bands[-1][1] = bottom
+                else:
+                    bands.append([kept, bottom, top])
+            for (kept, bottom, top) in bands:
+                unchanged = (kept is None
+                          or all(len(indices) == len(line) for (indices, line) in zip(kept, lines)))
+                first_part = (feature.first_part if unchanged else
+                              store.add_parts([line[indices] for (line, indices) in zip(lines, kept)]))
+                yield Feature(feature.id, feature.properties, feature.geometry_type,
+                              first_part, feature.part_count, feature.bbox,
+                              min_zoom=bottom, max_zoom=(top if top < self._max_zoom else None))
+
+    def get_output(self):
+        return {
             'type': 'FeatureCollection',
             'id': self.layer_id,
             'creator': 'pptx2geo',        # Add version
-            'features': self._features,
+            'features': [geojson_feature(self._geometry, feature) for feature in self._geometry],
             'properties': {
                 'id': self.layer_id,
                 'description': self.description
             }
         }
 
-    def get_output(self):
-        return self._feature_collection
-
     def save(self, filename=None):
         if filename is None:
             filename = os.path.join(self.args.output_dir, '{}.json'.format(self.layer_id))
         with open(filename, 'w') as output_file:
-            json.dump(self._feature_collection, output_file)
+            json.dump(self.get_output(), output_file)
 
     def process_group(self, group, transform):
-        self.process_shape_list(group.shapes, transform*Transform(group).matrix())
+        return self.iterate_shape_list(group.shapes, transform@Transform(group).matrix())
 
     def process_shape(self, shape, transform):
-        feature = {
-            'type': 'Feature',
-            'id': shape.shape_id,
-            'properties': {}
-        }
+        properties = {}
         if shape.name_id != '':
-            feature['properties']['id'] = '{}/{}'.format(self.layer_id, shape.name_id)
-            feature['properties']['selectable'] = True
+            properties['id'] = '{}/{}'.format(self.layer_id, shape.name_id)
+            properties['selectable'] = True
         if len(shape.name_attributes):
-            feature['properties']['type'] = shape.name_attributes[0]
-        geometry = {}
+            properties['type'] = shape.name_attributes[0]
         coordinates = []
+        closed = None
+        for path in shape_paths(shape):
+            T = transform@Transform(shape, path.bbox).matrix()
+            vertices = path.vertices(shape_tolerance(self._tolerance, T))
+            coordinates.append(transform_points(T, vertices))
+            self._vertex_count += len(vertices)
+            closed = path.closed
+
+        if closed is not None:
+            # A shape's paths are joined into a single ring or line
+            lon_lat = points_to_lon_lat(np.concatenate(coordinates))
+            bbox = lon_lat.min(axis=0).tolist() + lon_lat.max(axis=0).tolist() if len(lon_lat) else None
+            yield self._geometry.add_feature(shape.shape_id, properties,
+                                             'Polygon' if closed else 'LineString', [lon_lat], bbox=bbox)
 
-        pptx_geometry = Geometry(shape)
-        for path in pptx_geometry.path_list:
-            bbox = (shape.width, shape.height) if path.w is None else (path.w, path.h)
-            T = transform*Transform(shape, bbox).matrix()
-
-            moved = False
-            first_point = None
-            current_point = None
-            closed = False
-
-            for c in path.getchildren():
-                if   c.tag == DML('arcTo'):
-                    wR = pptx_geometry.attrib_value(c, 'wR')
-                    hR = pptx_geometry.attrib_value(c, 'hR')
-                    stAng = radians(pptx_geometry.attrib_value(c, 'stAng'))
-                    swAng = radians(pptx_geometry.attrib_value(c, 'swAng'))
-                    p1 = ellipse_point(wR, hR, stAng)
-                    p2 = ellipse_point(wR, hR, stAng + swAng)
-                    pt = (current_point[0] - p1[0] + p2[0],
-                          current_point[1] - p1[1] + p2[1])
-                    large_arc_flag = 1 if swAng >= math.pi else 0
-                    beziers = cubic_beziers_from_arc(tuple2(wR, hR), 0, large_arc_flag, 1,
-                                                     tuple2(*current_point), tuple2(*pt))
-                    for bz in beziers:
-                        coordinates.extend(transform_bezier_samples(T, bz))
-                    current_point = pt
-
-                elif c.tag == DML('close'):
-                    if first_point is not None and current_point != first_point:
-                        coordinates.append(transform_point(T, first_point))
-                    closed = True
-                    first_point = None
-                    # Close current pptx_geometry and start a new one...
-
-                elif c.tag == DML('cubicBezTo'):
-                    coords = [BezierPoint(*current_point)]
-                    for p in c.getchildren():
-                        pt = pptx_geometry.point(p)
-                        coords.append(BezierPoint(*pt))
-                        current_point = pt
-                    bz = CubicBezier(*coords)
-                    coordinates.extend(transform_bezier_samples(T, bz))
-
-                elif c.tag == DML('lnTo'):
-                    pt = pptx_geometry.point(c.pt)
-                    if moved:
-                        coordinates.append(transform_point(T, current_point))
-                        moved = False
-                    coordinates.append(transform_point(T, pt))
-                    current_point = pt
-
-                elif c.tag == DML('moveTo'):
-                    pt = pptx_geometry.point(c.pt)
-                    if first_point is None:
-                        first_point = pt
-                    current_point = pt
-                    moved = True
-
-                elif c.tag == DML('quadBezTo'):
-                    coords = [BezierPoint(*current_point)]
-                    for p in c.getchildren():
-                        pt = pptx_geometry.point(p)
-                        coords.append(BezierPoint(*pt))
-                        current_point = pt
-                    bz = QuadraticBezier(*coords)
-                    coordinates.extend(transform_bezier_samples(T, bz))
-
-                else:
-                    print('Unknown path element: {}'.format(c.tag))
-
-            lat_lon = points_to_lon_lat(coordinates)
-            if closed:
-                geometry['type'] = 'Polygon'
-                geometry['coordinates'] = [ lat_lon ]
-            else:
-                geometry['type'] = 'LineString'
-                geometry['coordinates'] = lat_lon
+#===============================================================================
 
-            feature['geometry'] = geometry
-            self._features.append(feature)
+def geojson_feature(store, feature, layer_id=None):
+    """
+    A feature from a :class:`GeometryStore` as a GeoJSON feature, optionally
+    tagged with the `tippecanoe` layer it belongs to.
+    """
+    geojson = {
+        'type': 'Feature',
+        'id': feature.id,
+        'properties': feature.properties
+    }
+    if feature.bbox is not None:
+        geojson['bbox'] = feature.bbox
+    parts = [part.tolist() for part in store.parts(feature)]
+    if feature.geometry_type == 'Polygon':
+        geojson['geometry'] = {'type': 'Polygon', 'coordinates': parts}
+    elif len(parts) == 1:
+        geojson['geometry'] = {'type': 'LineString', 'coordinates': parts[0]}
+    else:
+        geojson['geometry'] = {'type': 'MultiLineString', 'coordinates': parts}
+    tippecanoe = {}
+    if feature.min_zoom is not None:
+        tippecanoe['minzoom'] = feature.min_zoom
+    if feature.max_zoom is not None:
+        tippecanoe['maxzoom'] = feature.max_zoom
+    if layer_id is not None:
+        tippecanoe['layer'] = layer_id
+    if tippecanoe:
+        geojson['tippecanoe'] = tippecanoe
+    return geojson
+
+def write_geojson_seq(store, output_file, layer_id=None, features=None):
+    """
+    Write features of a :class:`GeometryStore`, all of them unless given,
+    as newline-delimited GeoJSON, optionally tagging each with the
+    `tippecanoe` layer it belongs to.
+    """
+    for feature in (store if features is None else features):
+        output_file.write(json.dumps(geojson_feature(store, feature, layer_id)))
+        output_file.write('\n')
 
 #===============================================================================
 
@@ -194,11 +260,11 @@ class GeoJsonExtractor(GeometryExtractor):
     def __init__(self, pptx, args):
         super().__init__(pptx, args)
         self._SlideMaker = MakeGeoJsonSlide
-        self._transform = np.matrix([[WORLD_PER_EMU,              0, 0],
-                                     [            0, -WORLD_PER_EMU, 0],
-                                     [            0,              0, 1]])*np.matrix([[1, 0, -self._slide_size[0]/2.0],
-                                                                                     [0, 1, -self._slide_size[1]/2.0],
-                                                                                     [0, 0,                      1.0]])
+        self._transform = np.array([[WORLD_PER_EMU,              0, 0],
+                                    [            0, -WORLD_PER_EMU, 0],
+                                    [            0,              0, 1]])@np.array([[1, 0, -self._slide_size[0]/2.0],
+                                                                                   [0, 1, -self._slide_size[1]/2.0],
+                                                                                   [0, 0,                      1.0]])
     @property
     def transform(self):
         return self._transform
@@ -0,0 +1,127 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""
+A columnar store for the geometry of a slide's features, with coordinates
+kept in a single array rather than as lists of tuples.
+"""
+
+#===============================================================================
+
+import numpy as np
+
+#===============================================================================
+
+class Feature(object):
+    """
+    A feature's details, with its geometry as a run of parts, the rings of a
+    polygon or the lines of a line string, in a :class:`GeometryStore`.
+    """
+    __slots__ = ('id', 'properties', 'geometry_type', 'first_part', 'part_count',
+                 'bbox', 'min_zoom', 'max_zoom')
+
+    def __init__(self, id, properties, geometry_type, first_part, part_count,
+                 bbox=None, min_zoom=None, max_zoom=None):
+        self.id = id
+        self.properties = properties
+        self.geometry_type = geometry_type
+        self.first_part = first_part
+        self.part_count = part_count
+        self.bbox = bbox
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+
+    @property
+    def parts(self):
+        return range(self.first_part, self.first_part + self.part_count)
+
+#===============================================================================
+
+class GeometryStore(object):
+    """
+    Features along with the coordinates of all their parts, as one (N, 2)
+    float64 array and the offset of each part's first point in it.
+
+    Parts are added in chunks and only joined into the array when
+    coordinates are next read.
+    """
+    def __init__(self):
+        self._features = []
+        self._coordinates = np.empty((0, 2), dtype=np.float64)
+        self._chunks = []
+        self._offsets = [0]
+
+    def __iter__(self):
+        return iter(self._features)
+
+    def __len__(self):
+        return len(self._features)
+
+    @property
+    def coordinates(self):
+        if self._chunks:
+            self._coordinates = np.concatenate([self._coordinates] + self._chunks)
+            self._chunks = []
+        return self._coordinates
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    def add_parts(self, parts):
+        """
+        Add the coordinates of parts, returning the index of the first.
+        """
+        first_part = len(self._offsets) - 1
+        for part in parts:
+            points = np.asarray(part, dtype=np.float64).reshape((-1, 2))
+            self._chunks.append(points)
+            self._offsets.append(self._offsets[-1] + len(points))
+        return first_part
+
+    def add_feature(self, id, properties, geometry_type, parts, **kwds):
+        """
+        Add a feature along with the coordinates of its parts.
+        """
+        feature = Feature(id, properties, geometry_type, self.add_parts(parts), len(parts), **kwds)
+        self._features.append(feature)
+        return feature
+
+    def parts(self, feature):
+        """
+        The coordinates of a feature's parts. Parts still in chunks are read
+        from them, so that features can be written as they are added without
+        joining the array each time.
+        """
+        first_chunk = len(self._offsets) - 1 - len(self._chunks)
+        if feature.first_part >= first_chunk:
+            start = feature.first_part - first_chunk
+            return self._chunks[start:start + feature.part_count]
+        coordinates = self.coordinates
+        return [coordinates[self._offsets[index]:self._offsets[index + 1]] for index in feature.parts]
+
+    def replace_features(self, features):
+        """
+        Replace the store's features with others whose parts are in it, such
+        as simplified copies.
+        """
+        self._features = list(features)
+
+#===============================================================================
@@ -0,0 +1,246 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""Evaluate a shape's paths, caching results for identical preset shapes."""
+
+#===============================================================================
+
+from collections import OrderedDict
+import math
+
+import pptx.shapes.connector
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+
+import numpy as np
+
+#===============================================================================
+
+from .arc_to_bezier import cubic_beziers_from_arc, tuple2
+from .extractor import ellipse_point
+from .flatten import flatten_cubics, quadratic_to_cubic
+from .formula import Geometry, radians
+from .presets import DML
+
+#===============================================================================
+
+class ShapePath(object):
+    """
+    A path of a shape with all guides evaluated, in the shape's
+    (untransformed) coordinate space.
+
+    Segments are tuples of:
+
+    * ``('M', point)``
+    * ``('L', point)``
+    * ``('A', start, radii, large_arc_flag, point)``
+    * ``('C', start, control_points)``
+    * ``('Q', start, control_points)``
+    * ``('Z', closing_point)``, where ``closing_point`` is ``None`` when the
+      path is already at its first point.
+    """
+    def __init__(self, path, geometry, shape_size):
+        self._bbox = shape_size if path.w is None else (path.w, path.h)
+        self._segments = []
+        self._closed = False
+        self._vertices = {}
+
+        first_point = None
+        current_point = None
+        for c in path.getchildren():
+            if   c.tag == DML('arcTo'):
+                wR = geometry.attrib_value(c, 'wR')
+                hR = geometry.attrib_value(c, 'hR')
+                stAng = radians(geometry.attrib_value(c, 'stAng'))
+                swAng = radians(geometry.attrib_value(c, 'swAng'))
+                p1 = ellipse_point(wR, hR, stAng)
+                p2 = ellipse_point(wR, hR, stAng + swAng)
+                pt = (current_point[0] - p1[0] + p2[0],
+                      current_point[1] - p1[1] + p2[1])
+                large_arc_flag = 1 if swAng >= math.pi else 0
+                self._segments.append(('A', current_point, (wR, hR), large_arc_flag, pt))
+                current_point = pt
+
+            elif c.tag == DML('close'):
+                if first_point is not None and current_point != first_point:
+                    self._segments.append(('Z', first_point))
+                else:
+                    self._segments.append(('Z', None))
+                self._closed = True
+                first_point = None
+
+            elif c.tag in [DML('cubicBezTo'), DML('quadBezTo')]:
+                start = current_point
+                coords = []
+                for p in c.getchildren():
+                    pt = geometry.point(p)
+                    coords.append(pt)
+                    current_point = pt
+                self._segments.append(('C' if c.tag == DML('cubicBezTo') else 'Q',
+                                       start, coords))
+
+            elif c.tag == DML('lnTo'):
+                pt = geometry.point(c.pt)
+                self._segments.append(('L', pt))
+                current_point = pt
+
+            elif c.tag == DML('moveTo'):
+                pt = geometry.point(c.pt)
+                self._segments.append(('M', pt))
+                if first_point is None:
+                    first_point = pt
+                current_point = pt
+
+            else:
+                print('Unknown path element: {}'.format(c.tag))
+
+    @property
+    def bbox(self):
+        return self._bbox
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def segments(self):
+        return self._segments
+
+    def vertices(self, tolerance):
+        """
+        The path as an (N, 2) array of points, with curves and arcs
+        flattened to within ``tolerance`` (in shape units).
+        """
+        vertices = self._vertices.get(tolerance)
+        if vertices is None:
+            vertices = self._flatten(tolerance)
+            self._vertices[tolerance] = vertices
+        return vertices
+
+    def _flatten(self, tolerance):
+        # Lines are kept as points and curves as indices into a list of
+        # cubics, so that all of the path's curves are flattened together
+        pieces = []
+        curves = []
+        moved = False
+        current_point = None
+        for segment in self._segments:
+            if   segment[0] == 'A':
+                (start, radii, large_arc_flag, pt) = segment[1:]
+                beziers = cubic_beziers_from_arc(tuple2(*radii), 0, large_arc_flag, 1,
+                                                 tuple2(*start), tuple2(*pt))
+                for bz in beziers:
+                    pieces.append(len(curves))
+                    curves.append([(p.x, p.y) for p in bz.points])
+                current_point = pt
+            elif segment[0] == 'C':
+                pieces.append(len(curves))
+                curves.append([segment[1]] + segment[2])
+                current_point = segment[2][-1]
+            elif segment[0] == 'L':
+                if moved:
+                    pieces.append(current_point)
+                    moved = False
+                pieces.append(segment[1])
+                current_point = segment[1]
+            elif segment[0] == 'M':
+                current_point = segment[1]
+                moved = True
+            elif segment[0] == 'Q':
+                pieces.append(len(curves))
+                curves.append(quadratic_to_cubic(segment[1], *segment[2]))
+                current_point = segment[2][-1]
+            elif segment[0] == 'Z':
+                if segment[1] is not None:
+                    pieces.append(segment[1])
+
+        polylines = flatten_cubics(curves, tolerance)
+        vertices = []
+        for piece in pieces:
+            if isinstance(piece, int):
+                polyline = polylines[piece]
+                if len(vertices) and tuple(polyline[0]) == tuple(vertices[-1]):
+                    polyline = polyline[1:]
+                vertices.extend(polyline)
+            else:
+                vertices.append(piece)
+        return np.array(vertices, dtype=np.float64).reshape((-1, 2))
+
+#===============================================================================
+
+class PathCache(object):
+    """
+    A bounded LRU cache of evaluated shape paths, keyed by preset name,
+    shape extent and adjustment values.
+    """
+    def __init__(self, maxsize=4096):
+        self._maxsize = maxsize
+        self._cache = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    @staticmethod
+    def key(shape):
+        if shape.shape_type == MSO_SHAPE_TYPE.AUTO_SHAPE:
+            prstGeom = shape.element.prstGeom
+            adjustments = (tuple((gd.name, gd.fmla) for gd in prstGeom.avLst)
+                               if prstGeom.avLst is not None else
+                           ())
+        elif (shape.shape_type == MSO_SHAPE_TYPE.PICTURE
+           or isinstance(shape, pptx.shapes.connector.Connector)):
+            prstGeom = shape.element.spPr.prstGeom
+            adjustments = ()
+        else:
+            return None     # Custom geometry is never shared
+        return (prstGeom.attrib['prst'], shape.width, shape.height, adjustments)
+
+    def paths(self, shape):
+        key = PathCache.key(shape)
+        if key is not None:
+            paths = self._cache.get(key)
+            if paths is not None:
+                self._cache.move_to_end(key)
+                self._hits += 1
+                return paths
+        self._misses += 1
+        geometry = Geometry(shape)
+        paths = [ShapePath(path, geometry, (shape.width, shape.height))
+                    for path in geometry.path_list]
+        if key is not None:
+            self._cache[key] = paths
+            if len(self._cache) > self._maxsize:
+                self._cache.popitem(last=False)
+        return paths
+
+#===============================================================================
+
+path_cache = PathCache()
+
+def shape_paths(shape):
+    return path_cache.paths(shape)
+
+#===============================================================================
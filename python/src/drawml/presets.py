@@ -18,7 +18,10 @@
 #
 #===============================================================================
 
+import hashlib
+import json
 import os.path
+import re
 
 import pptx.oxml as oxml
 import pptx.oxml.ns as ns
@@ -80,18 +83,79 @@ oxml.register_element_cls("drawml:presetShape", PresetShape)
 
 #===============================================================================
 
-class Shapes(object):
+PRESET_DEFINITIONS = os.path.join(os.path.dirname(__file__), 'presetShapeDefinitions.xml')
 
-    definitions_ = {}
+PRESET_INDEX = os.path.join(os.path.dirname(__file__), 'presetShapeDefinitions.index.json')
 
+PRESET_START = re.compile(rb'<drawml:presetShape\s+name="([^"]+)"')
+PRESET_END = b'</drawml:presetShape>'
 
+DEFINITIONS_START = (b'<drawml:presetShapeDefinitions xmlns:drawml="'
+                   + ns._nsmap['drawml'].encode() + b'">')
+DEFINITIONS_END = b'</drawml:presetShapeDefinitions>'
+
+#===============================================================================
 
-    with open(os.path.join(os.path.dirname(__file__), 'presetShapeDefinitions.xml'), 'rb') as defs:
-        for defn in PresetShapeDefinition.new(defs.read()):
-            definitions_[defn.name] = defn
+def build_index(xml):
+    """
+    Index preset shape definitions by name, giving the byte offset and
+    length of each definition in the definitions file.
+    """
+    index = {}
+    for match in PRESET_START.finditer(xml):
+        end = xml.index(PRESET_END, match.end()) + len(PRESET_END)
+        index[match.group(1).decode()] = [match.start(), end - match.start()]
+    return index
+
+def definitions_hash(xml):
+    return hashlib.sha1(xml).hexdigest()
+
+def save_index():
+    with open(PRESET_DEFINITIONS, 'rb') as defs:
+        xml = defs.read()
+    with open(PRESET_INDEX, 'w') as output_file:
+        json.dump({'sha1': definitions_hash(xml), 'index': build_index(xml)}, output_file, sort_keys=True)
+
+def load_index():
+    # Fall back to scanning the definitions if the index is missing or stale.
+    # The index is checked against a hash of the definitions, as checking out
+    # the repository changes file times and an edit may not change the size.
+    with open(PRESET_DEFINITIONS, 'rb') as defs:
+        xml = defs.read()
+    try:
+        with open(PRESET_INDEX) as index_file:
+            index = json.load(index_file)
+        if index['sha1'] == definitions_hash(xml):
+            return index['index']
+    except (OSError, ValueError, KeyError):
+        pass
+    return build_index(xml)
+
+#===============================================================================
+
+class Shapes(object):
+
+    definitions_ = {}
+    index_ = None
 
     @staticmethod
     def lookup(name):
-        return Shapes.definitions_[name]
+        definition = Shapes.definitions_.get(name)
+        if definition is None:
+            if Shapes.index_ is None:
+                Shapes.index_ = load_index()
+            (offset, length) = Shapes.index_[name]
+            with open(PRESET_DEFINITIONS, 'rb') as defs:
+                defs.seek(offset)
+                xml = defs.read(length)
+            definition = PresetShapeDefinition.new(DEFINITIONS_START + xml + DEFINITIONS_END)[0]
+            Shapes.definitions_[name] = definition
+        return definition
+
+#===============================================================================
+
+if __name__ == '__main__':
+    # Regenerate the index after updating `presetShapeDefinitions.xml`
+    save_index()
 
 #===============================================================================
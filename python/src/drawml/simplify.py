@@ -0,0 +1,214 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""Simplify polylines, keeping vertices that are shared between shapes."""
+
+#===============================================================================
+
+import math
+
+#===============================================================================
+
+import numpy as np
+
+#===============================================================================
+
+# Vector tiles are this many tile units across
+
+TILE_EXTENT = 4096
+
+# Highest zoom level of tiles, when not given
+
+DEFAULT_MAX_ZOOM = 14
+
+# Simplification tolerance, in tile units at the highest zoom level of a band
+
+DEFAULT_SIMPLIFY_TOLERANCE = 1.0
+
+# Number of zoom levels that share a simplified geometry
+
+ZOOM_BAND_SIZE = 3
+
+#===============================================================================
+
+def lon_lat_to_mercator(coords):
+#===============================
+    """
+    Convert an (N, 2) array of longitude and latitude into normalised Web
+    Mercator coordinates, with (0, 0) at the top left of the world, so that
+    a tile at zoom level Z is ``1/2**Z`` across.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape((-1, 2))
+    x = (coords[:, 0] + 180.0)/360.0
+    lat = np.radians(coords[:, 1])
+    y = (1.0 - np.log(np.tan(lat) + 1.0/np.cos(lat))/math.pi)/2.0
+    return np.column_stack((x, y))
+
+def tile_tolerance(tolerance, zoom):
+#===================================
+    # A tolerance in tile units at a zoom level, in normalised coordinates
+    return tolerance/(TILE_EXTENT*(1 << zoom))
+
+#===============================================================================
+
+def segment_distances(points, starts, ends):
+#===========================================
+    """
+    The distance of each point from the line segment between its start and end.
+    """
+    chord = ends - starts
+    length_squared = (chord**2).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(length_squared > 0,
+                     ((points - starts)*chord).sum(axis=1)/length_squared, 0.0)
+    nearest = starts + np.clip(t, 0.0, 1.0)[:, np.newaxis]*chord
+    return np.sqrt(((points - nearest)**2).sum(axis=1))
+
+def douglas_peucker(points, tolerance, anchors):
+#===============================================
+    """
+    Douglas-Peucker simplification of an (N, 2) polyline, as a boolean mask
+    of the points kept. Points marked in ``anchors``, which must include the
+    first and last points, are always kept.
+
+    All the segments between kept points are split at once, a round at a
+    time, rather than recursively.
+    """
+    count = len(points)
+    kept = anchors.copy()
+    indices = np.arange(count)
+    while True:
+        kept_indices = np.flatnonzero(kept)
+        segments = np.minimum(np.searchsorted(kept_indices, indices, side='right') - 1,
+                              len(kept_indices) - 2)
+        distances = segment_distances(points, points[kept_indices[segments]],
+                                      points[kept_indices[segments + 1]])
+        distances[kept] = 0.0
+        # The furthest point of each segment
+        order = np.lexsort((-distances, segments))
+        furthest = order[np.concatenate(([0], np.flatnonzero(np.diff(segments[order])) + 1))]
+        furthest = furthest[distances[furthest] > tolerance]
+        if len(furthest) == 0:
+            return kept
+        kept[furthest] = True
+
+def visvalingam(points, tolerance, anchors):
+#===========================================
+    """
+    Visvalingam-Whyatt simplification of an (N, 2) polyline, as a boolean
+    mask of the points kept, removing points whose triangles with their
+    neighbours have an area less than ``(2*tolerance)**2``, which keeps
+    flattened curves within ``tolerance``. Points marked in ``anchors`` are
+    always kept.
+
+    Each round removes every point whose area is below the threshold and is
+    a local minimum, so that no two neighbouring points are removed at once.
+    """
+    kept = np.ones(len(points), dtype=bool)
+    threshold = (2*tolerance)**2
+    while True:
+        kept_indices = np.flatnonzero(kept)
+        if len(kept_indices) < 3:
+            return kept
+        (previous, current, following) = (points[kept_indices[:-2]], points[kept_indices[1:-1]],
+                                          points[kept_indices[2:]])
+        areas = np.abs((current[:, 0] - previous[:, 0])*(following[:, 1] - previous[:, 1])
+                     - (following[:, 0] - previous[:, 0])*(current[:, 1] - previous[:, 1]))/2.0
+        areas[anchors[kept_indices[1:-1]]] = np.inf
+        padded = np.concatenate(([np.inf], areas, [np.inf]))
+        removed = (areas < threshold) & (areas < padded[:-2]) & (areas <= padded[2:])
+        if not removed.any():
+            return kept
+        kept[kept_indices[1:-1][removed]] = False
+
+SIMPLIFIERS = {
+    'douglas-peucker': douglas_peucker,
+    'visvalingam': visvalingam
+}
+
+#===============================================================================
+
+def shared_vertex_counts(parts):
+#===============================
+    """
+    For each vertex of a list of (N, 2) arrays, the number of the arrays that
+    contain it.
+    """
+    if len(parts) == 0:
+        return []
+    vertices = np.concatenate(parts)
+    part_numbers = np.repeat(np.arange(len(parts)), [len(part) for part in parts])
+    (unique, inverse) = np.unique(vertices, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    # Count each vertex once per part
+    pairs = np.unique(np.column_stack((inverse, part_numbers)), axis=0)
+    counts = np.bincount(pairs[:, 0], minlength=len(unique))[inverse]
+    return np.split(counts, np.cumsum([len(part) for part in parts])[:-1])
+
+def topology_anchors(shared_counts, closed):
+#===========================================
+    """
+    The vertices of a part that must be kept for shared edges to stay shared:
+    its ends, and shared vertices where the number of parts sharing them
+    changes.
+    """
+    anchors = np.zeros(len(shared_counts), dtype=bool)
+    anchors[[0, -1]] = True
+    if len(shared_counts) > 2:
+        if closed:
+            previous = np.roll(shared_counts, 1)
+            following = np.roll(shared_counts, -1)
+        else:
+            previous = np.concatenate(([0], shared_counts[:-1]))
+            following = np.concatenate((shared_counts[1:], [0]))
+        anchors |= (shared_counts > 1) & ((previous != shared_counts) | (following != shared_counts))
+    return anchors
+
+def simplify(points, tolerance, anchors, method='douglas-peucker'):
+#=================================================================
+    """
+    The indices of the points of a polyline kept when it is simplified.
+    """
+    if len(points) <= 2:
+        return np.arange(len(points))
+    return np.flatnonzero(SIMPLIFIERS[method](points, tolerance, anchors))
+
+#===============================================================================
+
+def zoom_bands(map_size, max_zoom, band_size=ZOOM_BAND_SIZE):
+#============================================================
+    """
+    Ranges of zoom levels, from ``max_zoom`` down, that share a simplified
+    geometry. Below the zoom level at which a map of ``map_size``, as a
+    fraction of the world's width, fits in a single tile, all levels share
+    one geometry.
+    """
+    fitted_zoom = max(0, min(max_zoom, int(math.floor(-math.log2(map_size))))) if map_size > 0 else 0
+    bands = []
+    top = max_zoom
+    while top >= 0:
+        bottom = max(fitted_zoom, top - band_size + 1)
+        if bottom == fitted_zoom:
+            bottom = 0
+        bands.append((bottom, top))
+        top = bottom - 1
+    return bands
+
+#===============================================================================
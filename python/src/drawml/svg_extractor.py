@@ -18,7 +18,6 @@
 #
 #===============================================================================
 
-from math import pi as PI
 import os
 
 #===============================================================================
@@ -28,9 +27,8 @@ import svgwrite
 #===============================================================================
 
 from .extractor import GeometryExtractor, ProcessSlide, Transform
-from .extractor import EMU_PER_DOT, ellipse_point
-from .formula import Geometry, radians
-from .presets import DML
+from .extractor import EMU_PER_DOT
+from .paths import shape_paths
 
 #===============================================================================
 
@@ -75,65 +73,29 @@ class MakeSvgSlide(ProcessSlide):
         self.process_shape_list(group.shapes, svg_group)
 
     def process_shape(self, shape, svg_parent):
-        geometry = Geometry(shape)
-        for path in geometry.path_list:
-            bbox = (shape.width, shape.height) if path.w is None else (path.w, path.h)
+        for path in shape_paths(shape):
             svg_path = self._dwg.path(id=shape.shape_id, fill='none', stroke_width=3,
                                       class_='non-scaling-stroke')
-            svg_path.matrix(*svg_transform(Transform(shape, bbox).matrix()))
-            first_point = None
-            current_point = None
-            closed = False
-            for c in path.getchildren():
-                if   c.tag == DML('arcTo'):
-                    wR = geometry.attrib_value(c, 'wR')
-                    hR = geometry.attrib_value(c, 'hR')
-                    stAng = radians(geometry.attrib_value(c, 'stAng'))
-                    swAng = radians(geometry.attrib_value(c, 'swAng'))
-                    p1 = ellipse_point(wR, hR, stAng)
-                    p2 = ellipse_point(wR, hR, stAng + swAng)
-                    pt = (current_point[0] - p1[0] + p2[0],
-                          current_point[1] - p1[1] + p2[1])
-                    large_arc_flag = 1 if swAng >= PI else 0
-                    svg_path.push('A', svg_units(wR), svg_units(hR),
+            svg_path.matrix(*svg_transform(Transform(shape, path.bbox).matrix()))
+            for segment in path.segments:
+                if   segment[0] == 'A':
+                    (radii, large_arc_flag, pt) = segment[2:]
+                    svg_path.push('A', svg_units(radii[0]), svg_units(radii[1]),
                                        0, large_arc_flag, 1,
                                        svg_units(pt[0]), svg_units(pt[1]))
-                    current_point = pt
-
-                elif c.tag == DML('close'):
-                    if first_point is not None and current_point != first_point:
+                elif segment[0] == 'Z':
+                    if segment[1] is not None:
                         svg_path.push('Z')
-                    closed = True
-                    first_point = None
-                elif c.tag == DML('cubicBezTo'):
-                    coords = []
-                    for p in c.getchildren():
-                        pt = geometry.point(p)
-                        coords.append(svg_units(pt[0]))
-                        coords.append(svg_units(pt[1]))
-                        current_point = pt
-                    svg_path.push('C', *coords)
-                elif c.tag == DML('lnTo'):
-                    pt = geometry.point(c.pt)
-                    svg_path.push('L', svg_units(pt[0]), svg_units(pt[1]))
-                    current_point = pt
-                elif c.tag == DML('moveTo'):
-                    pt = geometry.point(c.pt)
-                    svg_path.push('M', svg_units(pt[0]), svg_units(pt[1]))
-                    if first_point is None:
-                        first_point = pt
-                    current_point = pt
-                elif c.tag == DML('quadBezTo'):
+                elif segment[0] in ['C', 'Q']:
                     coords = []
-                    for p in c.getchildren():
-                        pt = geometry.point(p)
+                    for pt in segment[2]:
                         coords.append(svg_units(pt[0]))
                         coords.append(svg_units(pt[1]))
-                        current_point = pt
-                    svg_path.push('Q', *coords)
-                else:
-                    print('Unknown path element: {}'.format(c.tag))
-            if closed:
+                    svg_path.push(segment[0], *coords)
+                elif segment[0] in ['L', 'M']:
+                    pt = segment[1]
+                    svg_path.push(segment[0], svg_units(pt[0]), svg_units(pt[1]))
+            if path.closed:
                 svg_path.attribs['fill'] = '#808080'
                 svg_path.attribs['opacity'] = 0.3
                 svg_path.attribs['stroke'] = 'red'
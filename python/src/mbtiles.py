@@ -18,18 +18,201 @@
 #
 #===============================================================================
 
-from landez.sources import MBTilesReader
+"""
+Read and write MBTiles databases, for both vector and raster tiles.
+"""
 
 #===============================================================================
 
-class TileDatabase(object):
-    def __init__(self, db_file):
-        self._db = MBTilesReader(db_file)
+import hashlib
+import itertools
+import os
+import sqlite3
 
-    def execute(self, sql):
-        return self._db._query(sql)
+#===============================================================================
+
+BATCH_SIZE = 1000
+
+MMAP_SIZE = 256*1024*1024
+
+#===============================================================================
+
+TILES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS metadata (name text, value text);
+    CREATE UNIQUE INDEX IF NOT EXISTS metadata_name ON metadata (name);
+    CREATE TABLE IF NOT EXISTS tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob);
+    CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row);
+'''
+
+# Identical tiles are stored once, with a ``tiles`` view for readers
+
+DEDUPLICATED_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS metadata (name text, value text);
+    CREATE UNIQUE INDEX IF NOT EXISTS metadata_name ON metadata (name);
+    CREATE TABLE IF NOT EXISTS map (zoom_level integer, tile_column integer, tile_row integer, tile_id text);
+    CREATE UNIQUE INDEX IF NOT EXISTS map_index ON map (zoom_level, tile_column, tile_row);
+    CREATE TABLE IF NOT EXISTS images (tile_id text, tile_data blob);
+    CREATE UNIQUE INDEX IF NOT EXISTS images_id ON images (tile_id);
+    CREATE VIEW IF NOT EXISTS tiles AS
+        SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+               map.tile_row AS tile_row, images.tile_data AS tile_data
+        FROM map JOIN images ON images.tile_id = map.tile_id;
+'''
+
+#===============================================================================
+
+def flip_row(zoom, row):
+#=======================
+    """
+    Convert between XYZ tile rows, numbered from the top, and the TMS rows of
+    MBTiles, numbered from the bottom.
+    """
+    return (1 << zoom) - 1 - row
+
+#===============================================================================
+
+class MBTiles(object):
+    """
+    An MBTiles database, kept open on a single connection.
+
+    Tile rows are as stored, numbered from the bottom (TMS). Writes are made
+    in batches and within a transaction that lasts until :meth:`commit`.
+
+    Writable databases use a write-ahead log while they are open, and are
+    returned to a rollback journal when closed so that no ``-wal`` and
+    ``-shm`` files are left beside them.
+    """
+    def __init__(self, filename, create=False, deduplicate=False, readonly=False):
+        self._filename = filename
+        self._readonly = readonly
+        if create:
+            directory = os.path.dirname(filename)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+        elif not os.path.exists(filename):
+            raise FileNotFoundError('No MBTiles database: {}'.format(filename))
+        if readonly:
+            self._db = sqlite3.connect('file:{}?mode=ro'.format(filename), uri=True)
+        else:
+            self._db = sqlite3.connect(filename)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('PRAGMA mmap_size={}'.format(MMAP_SIZE))
+        if create:
+            self._db.executescript(DEDUPLICATED_SCHEMA if deduplicate else TILES_SCHEMA)
+        self._deduplicated = self._db.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='images'").fetchone()[0] > 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        self.close()
+
+    @property
+    def filename(self):
+        return self._filename
+
+    def close(self):
+        if not self._readonly:
+            # Uncommitted changes are discarded on closing, and leaving the
+            # write-ahead log checkpoints it into the database
+            if self._db.in_transaction:
+                self._db.rollback()
+            self._db.execute('PRAGMA journal_mode=DELETE')
+        self._db.close()
+
+    def commit(self):
+        self._db.commit()
 
     def metadata(self):
-        return self._db.metadata()
+        return dict(self._db.execute('SELECT name, value FROM metadata'))
+
+    def update_metadata(self, values):
+        """
+        Set metadata from a dictionary or sequence of ``(name, value)`` pairs.
+        """
+        items = values.items() if isinstance(values, dict) else values
+        for (name, value) in items:
+            # Databases made by other tools may not have a unique index on names
+            if self._db.execute('UPDATE metadata SET value=? WHERE name=?',
+                                (value, name)).rowcount == 0:
+                self._db.execute('INSERT INTO metadata (name, value) VALUES (?, ?)', (name, value))
+
+    def get_tile(self, zoom, column, row):
+        result = self._db.execute('SELECT tile_data FROM tiles '
+                                  'WHERE zoom_level=? AND tile_column=? AND tile_row=?',
+                                  (zoom, column, row)).fetchone()
+        return result[0] if result is not None else None
+
+    def tiles(self, zoom=None, bounds=None):
+        """
+        Generate ``(zoom, column, row, data)`` for the tiles at a zoom level,
+        or at all levels, optionally within ``(min_column, min_row,
+        max_column, max_row)`` bounds.
+        """
+        (conditions, parameters) = ([], [])
+        if zoom is not None:
+            conditions.append('zoom_level=?')
+            parameters.append(zoom)
+        if bounds is not None:
+            conditions.append('tile_column BETWEEN ? AND ? AND tile_row BETWEEN ? AND ?')
+            parameters.extend([bounds[0], bounds[2], bounds[1], bounds[3]])
+        cursor = self._db.execute('SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles'
+                                  + (' WHERE ' + ' AND '.join(conditions) if conditions else '')
+                                  + ' ORDER BY zoom_level, tile_column, tile_row', parameters)
+        while True:
+            rows = cursor.fetchmany(BATCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+
+    def tile_count(self, zoom=None):
+        if zoom is None:
+            return self._db.execute('SELECT COUNT(*) FROM tiles').fetchone()[0]
+        return self._db.execute('SELECT COUNT(*) FROM tiles WHERE zoom_level=?', (zoom,)).fetchone()[0]
+
+    def unique_tile_count(self):
+        table = 'images' if self._deduplicated else 'tiles'
+        return self._db.execute('SELECT COUNT(*) FROM {}'.format(table)).fetchone()[0]
+
+    def save_tiles(self, tiles):
+        """
+        Insert or replace ``(zoom, column, row, data)`` tiles.
+        """
+        tiles = iter(tiles)
+        while True:
+            batch = list(itertools.islice(tiles, BATCH_SIZE))
+            if not batch:
+                break
+            if self._deduplicated:
+                images = {}
+                rows = []
+                for (zoom, column, row, data) in batch:
+                    tile_id = hashlib.sha1(data).hexdigest()
+                    images[tile_id] = data
+                    rows.append((zoom, column, row, tile_id))
+                self._db.executemany('INSERT OR IGNORE INTO images (tile_id, tile_data) VALUES (?, ?)',
+                                     images.items())
+                self._db.executemany('INSERT OR REPLACE INTO map VALUES (?, ?, ?, ?)', rows)
+            else:
+                self._db.executemany('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)', batch)
+
+    def remove_tiles(self, keys):
+        """
+        Remove ``(zoom, column, row)`` tiles, along with any images that are
+        no longer used.
+        """
+        table = 'map' if self._deduplicated else 'tiles'
+        self._db.executemany('DELETE FROM {} WHERE zoom_level=? AND tile_column=? AND tile_row=?'
+                             .format(table), keys)
+        self.remove_unused_images()
+
+    def remove_unused_images(self):
+        # Replaced tiles may also leave images unused
+        if self._deduplicated:
+            self._db.execute('DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map)')
 
 #===============================================================================
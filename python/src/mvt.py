@@ -0,0 +1,647 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""
+Generate Mapbox vector tiles in-process, as an alternative to `tippecanoe`.
+
+Features are read as newline-delimited GeoJSON, with each feature naming its
+layer in a ``tippecanoe`` member. At each zoom level features are clipped to
+tiles, quantised to the tile's extent and encoded as protocol buffers, as
+described in https://github.com/mapbox/vector-tile-spec/tree/master/2.1.
+"""
+
+#===============================================================================
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import math
+import multiprocessing
+import os
+import pickle
+import struct
+
+#===============================================================================
+
+import numpy as np
+
+#===============================================================================
+
+from .mbtiles import MBTiles, flip_row
+from .spatial_index import SpatialIndex
+
+#===============================================================================
+
+EXTENT = 4096
+
+TILE_BUFFER = 64     # In tile units
+
+MIN_ZOOM = 0
+MAX_ZOOM = 14
+
+# Geometry types
+
+LINESTRING = 2
+POLYGON    = 3
+
+# Geometry commands
+
+MOVE_TO    = 1
+LINE_TO    = 2
+CLOSE_PATH = 7
+
+#===============================================================================
+
+def lon_lat_to_mercator(coords):
+#===============================
+    """
+    Convert an (N, 2) array of longitude and latitude into normalised
+    Web Mercator coordinates, with (0, 0) at the top left of the world.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape((-1, 2))
+    x = (coords[:, 0] + 180.0)/360.0
+    lat = np.radians(coords[:, 1])
+    y = (1.0 - np.log(np.tan(lat) + 1.0/np.cos(lat))/math.pi)/2.0
+    return np.column_stack((x, y))
+
+#===============================================================================
+
+def clip_ring(ring, axis, value, keep_above):
+#============================================
+    # One Sutherland-Hodgman step, against the line ``ring[:, axis] = value``
+    if len(ring) == 0:
+        return ring
+    d = ring[:, axis] - value
+    if not keep_above:
+        d = -d
+    inside = d >= 0
+    if inside.all():
+        return ring
+    if not inside.any():
+        return ring[:0]
+    prev = np.concatenate((ring[-1:], ring[:-1]))
+    prev_d = np.concatenate((d[-1:], d[:-1]))
+    crossing = inside != (prev_d >= 0)
+    t = np.divide(prev_d, prev_d - d, out=np.zeros_like(d), where=crossing)
+    intersection = prev + t[:, np.newaxis]*(ring - prev)
+    intersection[:, axis] = value
+    # Each edge outputs its intersection (if crossing) followed by its end (if inside)
+    candidates = np.stack((intersection, ring), axis=1)
+    return candidates[np.stack((crossing, inside), axis=1)]
+
+def clip_ring_to_slab(ring, axis, low, high):
+#============================================
+    return clip_ring(clip_ring(ring, axis, low, True), axis, high, False)
+
+def clip_line_to_slab(line, axis, low, high):
+#============================================
+    # Liang-Barsky, applied to all of a line's segments at once
+    values = line[:, axis]
+    if len(line) < 2 or (values >= low).all() and (values <= high).all():
+        return [line] if len(line) > 1 else []
+    (a, b) = (line[:-1], line[1:])
+    (a_v, b_v) = (values[:-1], values[1:])
+    delta = b_v - a_v
+    flat = delta == 0
+    safe_delta = np.where(flat, 1.0, delta)
+    t_low = np.where(flat, -np.inf, (low - a_v)/safe_delta)
+    t_high = np.where(flat, np.inf, (high - a_v)/safe_delta)
+    t0 = np.maximum(0.0, np.minimum(t_low, t_high))
+    t1 = np.minimum(1.0, np.maximum(t_low, t_high))
+    visible = np.where(flat, (low <= a_v) & (a_v <= high), t0 <= t1)
+    if not visible.any():
+        return []
+    # A segment starts a new part unless it continues on from a visible segment
+    continues = np.concatenate(([False], visible[:-1] & (t1[:-1] >= 1.0)))
+    starts = visible & ((t0 > 0.0) | ~continues)
+    p0 = a + t0[:, np.newaxis]*(b - a)
+    p1 = a + t1[:, np.newaxis]*(b - a)
+    points = np.stack((p0, p1), axis=1)[np.stack((starts, visible), axis=1)]
+    # Each part begins with the start point of its first segment
+    breaks = np.cumsum(starts.astype(np.int64) + visible)[starts] - 2
+    return [part for part in np.split(points, breaks[1:]) if len(part) > 1]
+
+#===============================================================================
+
+def remove_repeated_points(points):
+#==================================
+    if len(points) < 2:
+        return points
+    keep = np.concatenate(([True], (np.diff(points, axis=0) != 0).any(axis=1)))
+    return points[keep]
+
+def ring_area(ring):
+#===================
+    # Positive for a clockwise ring in tile coordinates (y down)
+    x = ring[:, 0]
+    y = ring[:, 1]
+    return (np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))/2.0
+
+def zigzag(values):
+#==================
+    return (values << 1) ^ (values >> 63)
+
+def encode_varints(values):
+#==========================
+    """
+    Encode an array of unsigned integers as protobuf varints.
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b''
+    sizes = np.ones(len(values), dtype=np.int64)
+    for n in range(1, 10):
+        more = values >= np.uint64(1 << (7*n))
+        if not more.any():
+            break
+        sizes += more
+    offsets = np.cumsum(sizes) - sizes
+    output = np.zeros(int(sizes.sum()), dtype=np.uint8)
+    for n in range(int(sizes.max())):
+        present = sizes > n
+        byte = (values[present] >> np.uint64(7*n)) & np.uint64(0x7f)
+        byte |= np.where(sizes[present] > n + 1, np.uint64(0x80), np.uint64(0))
+        output[offsets[present] + n] = byte.astype(np.uint8)
+    return output.tobytes()
+
+def varint(value):
+#=================
+    output = bytearray()
+    while value >= 0x80:
+        output.append((value & 0x7f) | 0x80)
+        value >>= 7
+    output.append(value)
+    return bytes(output)
+
+def field(number, wire_type):
+#============================
+    return varint((number << 3) | wire_type)
+
+def length_delimited(number, data):
+#==================================
+    return field(number, 2) + varint(len(data)) + data
+
+def command(id, count):
+#======================
+    return (id & 0x7) | (count << 3)
+
+#===============================================================================
+
+def decode_varints(data):
+#========================
+    """
+    Decode packed protobuf varints into an array of unsigned integers.
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = 7*(np.arange(len(data)) - np.repeat(starts, ends - starts + 1))
+    payload = (data & 0x7f).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(payload, starts)
+
+def read_varint(data, offset):
+#=============================
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (value, offset)
+        shift += 7
+
+def message_fields(data):
+#========================
+    """
+    Generate the ``(number, wire_type, value)`` fields of a protobuf message,
+    with the values of length delimited and fixed size fields as bytes.
+    """
+    offset = 0
+    while offset < len(data):
+        (key, offset) = read_varint(data, offset)
+        (number, wire_type) = (key >> 3, key & 0x7)
+        if wire_type == 0:
+            (value, offset) = read_varint(data, offset)
+        elif wire_type == 2:
+            (length, offset) = read_varint(data, offset)
+            value = data[offset:offset + length]
+            offset += length
+        elif wire_type in (1, 5):
+            length = 8 if wire_type == 1 else 4
+            value = data[offset:offset + length]
+            offset += length
+        else:
+            raise ValueError('Unsupported protobuf wire type {}'.format(wire_type))
+        yield (number, wire_type, value)
+
+def decode_value(data):
+#======================
+    for (number, wire_type, value) in message_fields(data):
+        if   number == 1:
+            return bytes(value).decode('utf-8')
+        elif number == 2:
+            return struct.unpack('<f', value)[0]
+        elif number == 3:
+            return struct.unpack('<d', value)[0]
+        elif number == 4:
+            return value - (1 << 64) if value >= (1 << 63) else value
+        elif number == 5:
+            return value
+        elif number == 6:
+            return (value >> 1) ^ -(value & 1)
+        elif number == 7:
+            return bool(value)
+    return None
+
+def geometry_vertex_count(geometry):
+#===================================
+    stream = decode_varints(geometry)
+    vertices = 0
+    n = 0
+    while n < len(stream):
+        (id, count) = (int(stream[n]) & 0x7, int(stream[n]) >> 3)
+        n += 1
+        if id in (MOVE_TO, LINE_TO):
+            vertices += count
+            n += 2*count
+    return vertices
+
+def decode_tile(data):
+#=====================
+    """
+    Summarise the features of a tile, as a dictionary of layer names to lists
+    of ``(id, properties, geometry_type, vertex_count, size)`` tuples, where
+    ``size`` is the number of bytes of the encoded feature.
+    """
+    layers = {}
+    for (number, wire_type, layer) in message_fields(memoryview(data)):
+        if number != 3:
+            continue
+        (name, features, keys, values) = (None, [], [], [])
+        for (number, wire_type, value) in message_fields(layer):
+            if   number == 1:
+                name = bytes(value).decode('utf-8')
+            elif number == 2:
+                features.append(value)
+            elif number == 3:
+                keys.append(bytes(value).decode('utf-8'))
+            elif number == 4:
+                values.append(decode_value(value))
+        summaries = layers.setdefault(name, [])
+        for feature in features:
+            (id, properties, geometry_type, vertex_count) = (None, {}, None, 0)
+            for (number, wire_type, value) in message_fields(feature):
+                if   number == 1:
+                    id = value
+                elif number == 2:
+                    tags = decode_varints(value)
+                    properties = {keys[int(k)]: values[int(v)] for (k, v) in zip(tags[0::2], tags[1::2])}
+                elif number == 3:
+                    geometry_type = value
+                elif number == 4:
+                    vertex_count = geometry_vertex_count(value)
+            summaries.append((id, properties, geometry_type, vertex_count, len(feature)))
+    return layers
+
+#===============================================================================
+
+def encode_geometry(parts, closed):
+#==================================
+    """
+    Encode quantised rings or lines, as (N, 2) integer arrays, into a
+    packed geometry command stream.
+    """
+    stream = []
+    cursor = np.zeros(2, dtype=np.int64)
+    for part in parts:
+        deltas = zigzag(np.diff(part, axis=0, prepend=cursor[np.newaxis, :]))
+        stream.append([command(MOVE_TO, 1)])
+        stream.append(deltas[0])
+        stream.append([command(LINE_TO, len(part) - 1)])
+        stream.append(deltas[1:].ravel())
+        if closed:
+            stream.append([command(CLOSE_PATH, 1)])
+        cursor = part[-1]
+    return encode_varints(np.concatenate(stream))
+
+def quantise_polygons(polygons):
+#===============================
+    parts = []
+    for polygon in polygons:
+        for (n, ring) in enumerate(polygon):
+            ring = remove_repeated_points(np.rint(ring).astype(np.int64))
+            if len(ring) > 1 and (ring[0] == ring[-1]).all():
+                ring = ring[:-1]
+            area = ring_area(ring) if len(ring) >= 3 else 0
+            if area == 0:
+                if n == 0:
+                    break       # No exterior ring so ignore holes
+                continue
+            # Exterior rings are clockwise and holes anti-clockwise
+            if (n == 0) != (area > 0):
+                ring = ring[::-1]
+            parts.append(ring)
+    return parts
+
+def quantise_lines(lines):
+#=========================
+    parts = []
+    for line in lines:
+        line = remove_repeated_points(np.rint(line).astype(np.int64))
+        if len(line) >= 2:
+            parts.append(line)
+    return parts
+
+#===============================================================================
+
+class TileLayer(object):
+    def __init__(self, name):
+        self._name = name
+        self._features = []
+        self._keys = {}
+        self._values = {}
+
+    def _index(self, table, item):
+        index = table.get(item)
+        if index is None:
+            index = len(table)
+            table[item] = index
+        return index
+
+    def add_feature(self, id, properties, geometry_type, geometry):
+        tags = []
+        for (key, value) in properties.items():
+            tags.append(self._index(self._keys, key))
+            tags.append(self._index(self._values, (type(value), value)))
+        feature = b''
+        if isinstance(id, int) and id >= 0:
+            feature += field(1, 0) + varint(id)
+        if tags:
+            feature += length_delimited(2, b''.join(varint(t) for t in tags))
+        feature += field(3, 0) + varint(geometry_type)
+        feature += length_delimited(4, geometry)
+        self._features.append(feature)
+
+    @staticmethod
+    def encode_value(value_type, value):
+        if   value_type == str:
+            return length_delimited(1, value.encode('utf-8'))
+        elif value_type == bool:
+            return field(7, 0) + varint(int(value))
+        elif value_type == int:
+            return (field(5, 0) + varint(value) if value >= 0 else
+                    field(6, 0) + varint((-value << 1) - 1))
+        elif value_type == float:
+            return field(3, 1) + struct.pack('<d', value)
+        return length_delimited(1, str(value).encode('utf-8'))
+
+    def encode(self):
+        layer = [length_delimited(1, self._name.encode('utf-8'))]
+        layer.extend(length_delimited(2, feature) for feature in self._features)
+        layer.extend(length_delimited(3, key.encode('utf-8')) for key in self._keys)
+        layer.extend(length_delimited(4, TileLayer.encode_value(*value)) for value in self._values)
+        layer.append(field(5, 0) + varint(EXTENT))
+        layer.append(field(15, 0) + varint(2))
+        return b''.join(layer)
+
+#===============================================================================
+
+# Forked worker processes inherit the features and their index. Otherwise
+# each worker loads the features from a file and indexes them itself
+
+worker_features = None
+worker_index = None
+
+def init_worker(features_file=None):
+    global worker_features, worker_index
+    if features_file is not None:
+        with open(features_file, 'rb') as input_file:
+            worker_features = pickle.load(input_file)
+        worker_index = SpatialIndex([feature[5] for feature in worker_features])
+
+def make_tiles(zoom, first_column, last_column):
+#===============================================
+    """
+    Make the tiles in a band of columns at a zoom level, returning a list
+    of ``(zoom, x, y, data)`` tuples.
+    """
+    scale = EXTENT*(1 << zoom)
+    tiles = {}
+    band = ((first_column*EXTENT - TILE_BUFFER)/scale, 0.0,
+            ((last_column + 1)*EXTENT + TILE_BUFFER)/scale, 1.0)
+    for index in sorted(worker_index.query_bbox(band)):
+        (layer, id, properties, geometry_type, parts, bbox, zoom_range) = worker_features[index]
+        if zoom not in zoom_range:
+            continue
+        columns = range(max(first_column, int((bbox[0]*scale - TILE_BUFFER)//EXTENT)),
+                        min(last_column, int((bbox[2]*scale + TILE_BUFFER)//EXTENT)) + 1)
+        rows = range(max(0, int((bbox[1]*scale - TILE_BUFFER)//EXTENT)),
+                     min((1 << zoom) - 1, int((bbox[3]*scale + TILE_BUFFER)//EXTENT)) + 1)
+        if len(columns) == 0 or len(rows) == 0:
+            continue
+        if geometry_type == POLYGON:
+            scaled = [[ring*scale for ring in polygon] for polygon in parts]
+        else:
+            scaled = [line*scale for line in parts]
+        for x in columns:
+            (left, right) = (x*EXTENT - TILE_BUFFER, (x + 1)*EXTENT + TILE_BUFFER)
+            if geometry_type == POLYGON:
+                column = [[clip_ring_to_slab(ring, 0, left, right) for ring in polygon]
+                             for polygon in scaled]
+            else:
+                column = [part for line in scaled
+                               for part in clip_line_to_slab(line, 0, left, right)]
+            for y in rows:
+                (top, bottom) = (y*EXTENT - TILE_BUFFER, (y + 1)*EXTENT + TILE_BUFFER)
+                origin = np.array([x*EXTENT, y*EXTENT])
+                if geometry_type == POLYGON:
+                    geometry = quantise_polygons([[clip_ring_to_slab(ring, 1, top, bottom) - origin
+                                                      for ring in polygon] for polygon in column])
+                else:
+                    geometry = quantise_lines([part - origin for line in column
+                                                  for part in clip_line_to_slab(line, 1, top, bottom)])
+                if len(geometry):
+                    tile_layer = tiles.setdefault((x, y), {}).get(layer)
+                    if tile_layer is None:
+                        tile_layer = TileLayer(layer)
+                        tiles[(x, y)][layer] = tile_layer
+                    tile_layer.add_feature(id, properties, geometry_type,
+                                           encode_geometry(geometry, geometry_type == POLYGON))
+    return [(zoom, x, y, b''.join(length_delimited(3, tile_layer.encode())
+                                    for tile_layer in layers.values()))
+                for ((x, y), layers) in tiles.items()]
+
+#===============================================================================
+
+class VectorTiler(object):
+    def __init__(self, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+        self._min_zoom = min_zoom
+        self._max_zoom = max_zoom
+        self._features = []
+        self._layers = {}
+        self._bounds = [1.0, 1.0, 0.0, 0.0]
+
+    def write(self, geojson_seq):
+        """
+        Add features from newline-delimited GeoJSON.
+        """
+        if isinstance(geojson_seq, bytes):
+            geojson_seq = geojson_seq.decode('utf-8')
+        for line in geojson_seq.splitlines():
+            if line.strip():
+                self.add_feature(json.loads(line))
+
+    def add_feature(self, feature):
+        tippecanoe = feature.get('tippecanoe', {})
+        layer = tippecanoe.get('layer', 'features')
+        geometry = feature['geometry']
+        if   geometry['type'] == 'Polygon':
+            (geometry_type, polygons) = (POLYGON, [geometry['coordinates']])
+        elif geometry['type'] == 'MultiPolygon':
+            (geometry_type, polygons) = (POLYGON, geometry['coordinates'])
+        elif geometry['type'] == 'LineString':
+            (geometry_type, lines) = (LINESTRING, [geometry['coordinates']])
+        elif geometry['type'] == 'MultiLineString':
+            (geometry_type, lines) = (LINESTRING, geometry['coordinates'])
+        else:
+            print('Unsupported geometry type: {}'.format(geometry['type']))
+            return
+        if geometry_type == POLYGON:
+            parts = [[lon_lat_to_mercator(ring) for ring in polygon if len(ring)]
+                        for polygon in polygons]
+            points = [ring for polygon in parts for ring in polygon]
+        else:
+            parts = [lon_lat_to_mercator(line) for line in lines if len(line)]
+            points = parts
+        if len(points) == 0:
+            return
+        points = np.concatenate(points)
+        bbox = (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+        self._bounds = [min(self._bounds[0], bbox[0]), min(self._bounds[1], bbox[1]),
+                        max(self._bounds[2], bbox[2]), max(self._bounds[3], bbox[3])]
+        properties = feature.get('properties', {})
+        # Features may be limited to a range of zoom levels
+        zoom_range = range(tippecanoe.get('minzoom', self._min_zoom),
+                           tippecanoe.get('maxzoom', self._max_zoom) + 1)
+        self._features.append((layer, feature.get('id'), properties, geometry_type, parts, bbox, zoom_range))
+
+        # Simplified copies of a feature for lower zoom levels have a `maxzoom`
+        stats = self._layers.setdefault(layer, {'count': 0, 'geometry': set(), 'attributes': {}})
+        stats['count'] += ('maxzoom' not in tippecanoe)
+        stats['geometry'].add('Polygon' if geometry_type == POLYGON else 'LineString')
+        for (key, value) in properties.items():
+            stats['attributes'].setdefault(key, set()).add(value)
+
+    def tasks(self, jobs):
+        # Split each zoom level into bands of columns so that high zoom
+        # levels are shared between worker processes
+        tasks = []
+        if not self._features:
+            return tasks
+        for zoom in range(self._min_zoom, self._max_zoom + 1):
+            first = int(self._bounds[0]*(1 << zoom))
+            last = min((1 << zoom) - 1, int(self._bounds[2]*(1 << zoom)))
+            bands = max(1, min(last - first + 1, 2*jobs))
+            width = int(math.ceil((last - first + 1)/bands))
+            for start in range(first, last + 1, width):
+                tasks.append((zoom, start, min(last, start + width - 1)))
+        return tasks
+
+    def metadata(self, name):
+        vector_layers = []
+        tilestats = {'layerCount': len(self._layers), 'layers': []}
+        for (layer, stats) in self._layers.items():
+            fields = {}
+            attributes = []
+            for (key, values) in stats['attributes'].items():
+                types = set('Boolean' if isinstance(v, bool) else
+                            'Number' if isinstance(v, (int, float)) else
+                            'String' for v in values)
+                fields[key] = types.pop() if len(types) == 1 else 'Mixed'
+                attributes.append({'attribute': key, 'count': len(values), 'type': fields[key],
+                                   'values': sorted(values, key=str)[:100]})
+            vector_layers.append({'id': layer, 'description': '', 'minzoom': self._min_zoom,
+                                  'maxzoom': self._max_zoom, 'fields': fields})
+            tilestats['layers'].append({'layer': layer, 'count': stats['count'],
+                                        'geometry': ' '.join(sorted(stats['geometry'])),
+                                        'attributeCount': len(attributes),
+                                        'attributes': attributes})
+        metadata = {
+            'name': name,
+            'format': 'pbf',
+            'type': 'overlay',
+            'version': '2',
+            'minzoom': str(self._min_zoom),
+            'maxzoom': str(self._max_zoom),
+            'json': json.dumps({'vector_layers': vector_layers, 'tilestats': tilestats})
+        }
+        # Without features there are no bounds to give
+        if self._features:
+            west = self._bounds[0]*360.0 - 180.0
+            east = self._bounds[2]*360.0 - 180.0
+            north = math.degrees(math.atan(math.sinh(math.pi*(1 - 2*self._bounds[1]))))
+            south = math.degrees(math.atan(math.sinh(math.pi*(1 - 2*self._bounds[3]))))
+            metadata['bounds'] = ','.join(str(b) for b in [west, south, east, north])
+            metadata['center'] = ','.join(str(c) for c in [(west + east)/2, (south + north)/2,
+                                                           self._min_zoom])
+        return metadata
+
+    def make_mbtiles(self, mbtiles_file, jobs=None):
+        """
+        Tile all features across a pool of processes and write them into a
+        new MBTiles database. Returns the number of tiles written.
+        """
+        jobs = jobs or os.cpu_count()
+        if os.path.exists(mbtiles_file):
+            os.remove(mbtiles_file)
+        global worker_features, worker_index
+        if 'fork' in multiprocessing.get_all_start_methods():
+            # The features are only loaded once, with forked workers sharing
+            # the parent's copy until they write to it
+            worker_features = self._features
+            worker_index = SpatialIndex([feature[5] for feature in self._features])
+            (context, features_file) = (multiprocessing.get_context('fork'), None)
+        else:
+            # Features are pickled once, rather than once for each worker
+            context = multiprocessing.get_context()
+            features_file = '{}.features'.format(mbtiles_file)
+            with open(features_file, 'wb') as output_file:
+                pickle.dump(self._features, output_file, pickle.HIGHEST_PROTOCOL)
+        tile_count = 0
+        try:
+            with MBTiles(mbtiles_file, create=True) as db:
+                db.update_metadata(self.metadata(os.path.basename(mbtiles_file)))
+                with ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=init_worker,
+                                         initargs=(features_file,)) as executor:
+                    futures = [executor.submit(make_tiles, *task) for task in self.tasks(jobs)]
+                    for future in as_completed(futures):
+                        tiles = future.result()
+                        # MBTiles rows are numbered from the bottom (TMS)
+                        db.save_tiles((z, x, flip_row(z, y), data) for (z, x, y, data) in tiles)
+                        tile_count += len(tiles)
+        finally:
+            (worker_features, worker_index) = (None, None)
+            if features_file is not None:
+                os.remove(features_file)
+        return tile_count
+
+#===============================================================================
@@ -19,6 +19,7 @@
 #===============================================================================
 
 from drawml import GeoJsonExtractor, SvgExtractor
+from drawml.flatten import DEFAULT_FLATTEN_TOLERANCE
 
 #===============================================================================
 
@@ -31,6 +32,10 @@ if __name__ == '__main__':
                         help="save a slide's DrawML for debugging")
     parser.add_argument('--format', choices=['geojson', 'svg'], default='geojson',
                         help='output format (default `geojson`)')
+    parser.add_argument('--flatten-tolerance', type=float, metavar='WORLD_UNITS',
+                        default=DEFAULT_FLATTEN_TOLERANCE,
+                        help='maximum deviation of flattened curves (default {})'
+                             .format(DEFAULT_FLATTEN_TOLERANCE))
     parser.add_argument('--slide', type=int, metavar='N',
                         help='only process this slide number (1-origin)')
     parser.add_argument('--version', action='version', version='0.2.1')
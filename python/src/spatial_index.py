@@ -0,0 +1,188 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""
+A static R-tree of bounding boxes, bulk loaded using Sort-Tile-Recursive
+packing, for finding the features that overlap a box or contain a point.
+"""
+
+#===============================================================================
+
+import json
+import math
+
+#===============================================================================
+
+import numpy as np
+
+#===============================================================================
+
+NODE_SIZE = 16
+
+#===============================================================================
+
+def str_order(boxes, node_size):
+#===============================
+    """
+    The order in which to pack boxes into nodes: sorted into vertical slices
+    by the x of their centres, then within each slice by the y of theirs.
+    """
+    count = len(boxes)
+    node_count = math.ceil(count/node_size)
+    slice_size = node_size*math.ceil(math.sqrt(node_count))
+    x = boxes[:, 0] + boxes[:, 2]
+    y = boxes[:, 1] + boxes[:, 3]
+    order = np.argsort(x, kind='stable')
+    slices = np.arange(count)//slice_size
+    return order[np.lexsort((y[order], slices))]
+
+def expand_ranges(starts, counts):
+#=================================
+    # The indices ``start, start + 1, ..., start + count - 1`` of all ranges
+    offsets = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) - np.repeat(offsets - starts, counts)
+
+def geometry_bbox(geometry):
+#===========================
+    points = []
+    def collect(coordinates):
+        if len(coordinates) and isinstance(coordinates[0], (int, float)):
+            points.append(coordinates[:2])
+        else:
+            for c in coordinates:
+                collect(c)
+    collect(geometry['coordinates'])
+    if len(points) == 0:
+        return None
+    points = np.array(points, dtype=np.float64)
+    return (*points.min(axis=0), *points.max(axis=0))
+
+#===============================================================================
+
+class SpatialIndex(object):
+    """
+    An R-tree over ``(min_x, min_y, max_x, max_y)`` boxes, each with an
+    associated id.
+
+    Nodes are kept level by level as arrays, with the leaves first, so that
+    queries test all the candidate children of a level at once.
+    """
+    def __init__(self, boxes, ids=None, node_size=NODE_SIZE):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape((-1, 4))
+        ids = list(range(len(boxes))) if ids is None else list(ids)
+        if len(ids) != len(boxes):
+            raise ValueError('There must be an id for each box')
+        self._node_size = node_size
+        self._ids = ids
+        self._levels = []
+        if len(boxes) == 0:
+            return
+        order = str_order(boxes, node_size)
+        self._ids = [ids[i] for i in order]
+        level = (boxes[order], None, None)
+        self._levels.append(level)
+        while len(level[0]) > 1:
+            (boxes, starts, counts) = level
+            if starts is not None:
+                order = str_order(boxes, node_size)
+                level = (boxes[order], starts[order], counts[order])
+                self._levels[-1] = level
+                boxes = level[0]
+            # Consecutive runs of nodes become the children of a parent node
+            starts = np.arange(0, len(boxes), node_size)
+            counts = np.diff(np.append(starts, len(boxes)))
+            level = (np.column_stack((np.minimum.reduceat(boxes[:, 0], starts),
+                                      np.minimum.reduceat(boxes[:, 1], starts),
+                                      np.maximum.reduceat(boxes[:, 2], starts),
+                                      np.maximum.reduceat(boxes[:, 3], starts))),
+                     starts, counts)
+            self._levels.append(level)
+
+    @classmethod
+    def from_features(cls, features, node_size=NODE_SIZE):
+        """
+        Index GeoJSON features by their ``bbox`` member, or by the extent of
+        their coordinates when they have none. Ids are feature ``id``\\s.
+        """
+        (boxes, ids) = ([], [])
+        for feature in features:
+            bbox = feature.get('bbox') or geometry_bbox(feature['geometry'])
+            if bbox is not None:
+                boxes.append(bbox[:4])
+                ids.append(feature.get('id'))
+        return cls(boxes, ids, node_size)
+
+    def __len__(self):
+        return len(self._ids)
+
+    @property
+    def bounds(self):
+        return tuple(self._levels[-1][0][0].tolist()) if self._levels else None
+
+    def query_bbox(self, bbox):
+        """
+        The ids of all boxes that overlap ``bbox``.
+        """
+        if not self._levels:
+            return []
+        (min_x, min_y, max_x, max_y) = bbox
+        nodes = np.zeros(1, dtype=np.int64)
+        for (n, (boxes, starts, counts)) in enumerate(reversed(self._levels)):
+            if n > 0:
+                (parent_starts, parent_counts) = self._levels[-n][1:]
+                nodes = expand_ranges(parent_starts[nodes], parent_counts[nodes])
+            candidates = boxes[nodes]
+            nodes = nodes[(candidates[:, 0] <= max_x) & (candidates[:, 2] >= min_x)
+                        & (candidates[:, 1] <= max_y) & (candidates[:, 3] >= min_y)]
+            if len(nodes) == 0:
+                return []
+        return [self._ids[i] for i in nodes]
+
+    def query_point(self, x, y):
+        """
+        The ids of all boxes that contain the point ``(x, y)``.
+        """
+        return self.query_bbox((x, y, x, y))
+
+    def save(self, filename):
+        with open(filename, 'w') as output_file:
+            json.dump({
+                'nodeSize': self._node_size,
+                'ids': self._ids,
+                'levels': [{
+                    'boxes': level[0].tolist(),
+                    'starts': level[1].tolist() if level[1] is not None else None,
+                    'counts': level[2].tolist() if level[2] is not None else None
+                } for level in self._levels]
+            }, output_file)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as input_file:
+            saved = json.load(input_file)
+        index = cls([], node_size=saved['nodeSize'])
+        index._ids = [tuple(id) if isinstance(id, list) else id for id in saved['ids']]
+        index._levels = [(np.array(level['boxes'], dtype=np.float64).reshape((-1, 4)),
+                          np.array(level['starts'], dtype=np.int64) if level['starts'] is not None else None,
+                          np.array(level['counts'], dtype=np.int64) if level['counts'] is not None else None)
+                            for level in saved['levels']]
+        return index
+
+#===============================================================================
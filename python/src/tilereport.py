@@ -0,0 +1,199 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""
+Report on the sizes of the vector tiles made by ``mapmaker.py``, and on the
+layers and features that make them large, so that the Powerpoint shapes that
+exceed the tile budget can be found.
+
+Run with ``python -m src.tilereport MBTILES_FILE``. Features are traced to
+their slides using the map's ``manifest.json``, when it is alongside.
+"""
+
+#===============================================================================
+
+import gzip
+import heapq
+import json
+import os
+
+#===============================================================================
+
+from .mbtiles import MBTiles, flip_row
+from .mvt import decode_tile
+
+#===============================================================================
+
+DEFAULT_BUDGET = 500     # KB, as for tippecanoe
+
+DEFAULT_TOP = 10
+
+# Upper bounds, in KB, of the histogram's buckets
+
+HISTOGRAM_BUCKETS = [4, 16, 64, 256, 1024]
+
+#===============================================================================
+
+def kilobytes(size):
+#===================
+    return '{:.1f} KB'.format(size/1024)
+
+#===============================================================================
+
+class TileReport(object):
+    """
+    Statistics of the tiles in an MBTiles database, gathered one tile at a
+    time.
+    """
+    def __init__(self, top=DEFAULT_TOP, budget=DEFAULT_BUDGET):
+        self._top = top
+        self._budget = budget*1024
+        self._zooms = {}
+        self._largest = {}
+        self._layers = {}
+        self._features = {}
+
+    def add_tile(self, zoom, column, row, data):
+        size = len(data)
+        if data[:2] == b'\x1f\x8b':
+            data = gzip.decompress(data)
+        layers = decode_tile(data)
+        vertices = 0
+        layer_sizes = {}
+        for (layer, features) in layers.items():
+            layer_size = sum(feature[4] for feature in features)
+            layer_vertices = sum(feature[3] for feature in features)
+            layer_sizes[layer] = layer_size
+            vertices += layer_vertices
+            stats = self._layers.setdefault(layer, [0, 0, 0, 0])
+            stats[0] += 1
+            stats[1] += len(features)
+            stats[2] += layer_vertices
+            stats[3] += layer_size
+            for (id, properties, geometry_type, vertex_count, feature_size) in features:
+                key = (layer, properties.get('id', id))
+                stats = self._features.get(key)
+                if stats is None:
+                    stats = [0, 0, 0, 0, None]
+                    self._features[key] = stats
+                stats[0] += 1
+                stats[1] += feature_size
+                if feature_size > stats[2]:
+                    stats[2:] = [feature_size, vertex_count, (zoom, column, flip_row(zoom, row))]
+        stats = self._zooms.setdefault(zoom, {'count': 0, 'bytes': 0, 'vertices': 0, 'over_budget': 0,
+                                              'histogram': [0]*(len(HISTOGRAM_BUCKETS) + 1)})
+        stats['count'] += 1
+        stats['bytes'] += size
+        stats['vertices'] += vertices
+        stats['over_budget'] += (size > self._budget)
+        stats['histogram'][sum(size > 1024*bound for bound in HISTOGRAM_BUCKETS)] += 1
+        # Keep the largest tiles of each zoom level
+        largest = self._largest.setdefault(zoom, [])
+        tile = (size, column, flip_row(zoom, row), vertices,
+                sum(len(features) for features in layers.values()),
+                max(layer_sizes, key=layer_sizes.get) if layer_sizes else '')
+        if len(largest) < self._top:
+            heapq.heappush(largest, tile)
+        else:
+            heapq.heappushpop(largest, tile)
+
+    def print(self, slides=None):
+        """
+        Print the report. ``slides`` maps layer ids to slide numbers.
+        """
+        slides = slides or {}
+        def source(layer, id):
+            slide = slides.get(layer)
+            shape = (id.partition('/')[2] if isinstance(id, str) and id.startswith(layer + '/')
+                     else 'shape id {}'.format(id))
+            return '{}{}'.format('slide {}: '.format(slide) if slide is not None else '', shape)
+
+        print('Tile sizes by zoom level (budget {}):'.format(kilobytes(self._budget)))
+        buckets = (['<= {} KB'.format(bound) for bound in HISTOGRAM_BUCKETS]
+                 + ['> {} KB'.format(HISTOGRAM_BUCKETS[-1])])
+        print('  zoom  tiles     total   average  vertices  over  ' + ''.join('{:>11}'.format(b) for b in buckets))
+        for zoom in sorted(self._zooms):
+            stats = self._zooms[zoom]
+            print('  {:>4} {:>6} {:>9} {:>9} {:>9} {:>5}  '.format(zoom, stats['count'],
+                      kilobytes(stats['bytes']), kilobytes(stats['bytes']/stats['count']),
+                      stats['vertices'], stats['over_budget'])
+                + ''.join('{:>11}'.format(n) for n in stats['histogram']))
+
+        print()
+        print('Largest tiles at each zoom level (Z/X/Y):')
+        for zoom in sorted(self._largest):
+            for (size, column, row, vertices, feature_count, layer) in sorted(self._largest[zoom], reverse=True):
+                print('  {}/{}/{}: {}, {} features, {} vertices, mostly {}{}'
+                      .format(zoom, column, row, kilobytes(size), feature_count, vertices, layer,
+                              ' (over budget)' if size > self._budget else ''))
+
+        print()
+        print('Layers:')
+        for (layer, (tiles, features, vertices, size)) in sorted(self._layers.items(),
+                                                               key=lambda item: -item[1][3]):
+            print('  {}{}: {} in {} tiles, {} features, {} vertices'
+                  .format(layer, ' (slide {})'.format(slides[layer]) if layer in slides else '',
+                          kilobytes(size), tiles, features, vertices))
+
+        print()
+        print('Largest features, by their total size in all tiles:')
+        features = heapq.nlargest(self._top, self._features.items(), key=lambda item: item[1][1])
+        for ((layer, id), (tiles, size, largest_size, vertices, tile)) in features:
+            print('  {} ({}): {} in {} tiles, largest {} with {} vertices in {}/{}/{}'
+                  .format(id, source(layer, id), kilobytes(size), tiles, kilobytes(largest_size),
+                          vertices, *tile))
+
+#===============================================================================
+
+def slide_numbers(mbtiles_file):
+#===============================
+    # Layer ids to slide numbers, from the manifest of the build
+    manifest_file = os.path.join(os.path.dirname(mbtiles_file), 'manifest.json')
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as manifest:
+        slides = json.load(manifest).get('slides', {})
+    return {details['layer']: int(number) for (number, details) in slides.items()}
+
+#===============================================================================
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Report on the sizes of vector tiles and their features.')
+    parser.add_argument('--budget', type=int, metavar='KB', default=DEFAULT_BUDGET,
+                        help='flag tiles larger than this (default {} KB)'.format(DEFAULT_BUDGET))
+    parser.add_argument('--top', type=int, metavar='N', default=DEFAULT_TOP,
+                        help='number of the largest tiles and features to list (default {})'
+                             .format(DEFAULT_TOP))
+    parser.add_argument('--zoom', type=int, metavar='N',
+                        help='only report on tiles at this zoom level')
+    parser.add_argument('mbtiles', metavar='MBTILES_FILE',
+                        help='the MBTiles made by `mapmaker.py`')
+
+    args = parser.parse_args()
+
+    report = TileReport(args.top, args.budget)
+    with MBTiles(args.mbtiles, readonly=True) as db:
+        for tile in db.tiles(args.zoom):
+            report.add_tile(*tile)
+    report.print(slide_numbers(args.mbtiles))
+
+#===============================================================================
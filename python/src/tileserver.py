@@ -0,0 +1,459 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+"""
+Serve flatmaps over HTTP, from a directory containing a directory for each map:
+
+* ``/MAP_ID/`` and ``/MAP_ID/index.json`` -- the map's style.
+* ``/MAP_ID/mvtiles/Z/X/Y`` -- vector tiles from ``index.mbtiles``, with rows
+  numbered from the top (XYZ).
+* ``/MAP_ID/tiles/LAYER/Z/X/Y`` -- raster tiles from ``tiles/LAYER.mbtiles``
+  or a ``tiles/LAYER`` directory, with rows numbered from the bottom (TMS) as
+  they are tiled.
+* ``/MAP_ID/images/NAME`` -- images.
+
+Responses are cached, up to a total size, and tagged so that clients can
+revalidate them. Tiles that are stored gzipped, and files that have a ``.gz``
+copy, are sent compressed to clients that accept it.
+
+Run with ``python -m src.tileserver MAPS_DIRECTORY``. The server should be
+restarted when a map is rebuilt.
+"""
+
+#===============================================================================
+
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import hashlib
+from http import HTTPStatus
+import mimetypes
+import os
+import random
+import time
+from urllib.parse import unquote, urlsplit
+
+#===============================================================================
+
+from .mbtiles import MBTiles, flip_row
+
+#===============================================================================
+
+DEFAULT_PORT = 8000
+
+DEFAULT_CACHE_SIZE = 256   # MB
+
+# Allow for the cache's own bookkeeping of an entry
+
+ENTRY_OVERHEAD = 256
+
+CONTENT_TYPES = {
+    'jpeg': 'image/jpeg',
+    'jpg': 'image/jpeg',
+    'json': 'application/json',
+    'mvt': 'application/x-protobuf',
+    'pbf': 'application/x-protobuf',
+    'png': 'image/png',
+    'webp': 'image/webp',
+}
+
+TILE_EXTENSIONS = ['png', 'webp', 'jpg', 'pbf', 'mvt']
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+#===============================================================================
+
+class Resource(object):
+    """
+    The content of a response, as stored, along with its type and digest.
+    """
+    def __init__(self, data, content_type, gzipped=False):
+        self._data = data
+        self._content_type = content_type
+        self._gzipped = gzipped
+        self._digest = hashlib.blake2b(data, digest_size=12).hexdigest()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def content_type(self):
+        return self._content_type
+
+    @property
+    def data(self):
+        return self._data
+
+    def etag(self, encoded):
+        """
+        The entity tag of the variant served, with the gzipped body of a
+        gzipped resource tagged separately from its decompressed body.
+        """
+        return '"{}-gzip"'.format(self._digest) if encoded else '"{}"'.format(self._digest)
+
+    @property
+    def gzipped(self):
+        return self._gzipped
+
+#===============================================================================
+
+class LRUCache(object):
+    """
+    A least recently used cache, bounded by the total size of its values.
+    """
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def misses(self):
+        return self._misses
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self._hits += 1
+        return entry[0]
+
+    def put(self, key, value, size):
+        size += ENTRY_OVERHEAD
+        if size > self._max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self._max_bytes:
+            self._bytes -= self._entries.popitem(last=False)[1][1]
+
+#===============================================================================
+
+def http_response(status, headers=None, body=b'', head=False):
+#=============================================================
+    lines = ['HTTP/1.1 {} {}'.format(status.value, status.phrase)]
+    headers = dict(headers or {})
+    # A 304's length would have to be that of the full response, so is omitted
+    if status != HTTPStatus.NOT_MODIFIED:
+        headers['Content-Length'] = str(len(body))
+    headers['Access-Control-Allow-Origin'] = '*'
+    lines.extend('{}: {}'.format(name, value) for (name, value) in headers.items())
+    response = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+    return response if head else response + body
+
+def safe_path(*parts):
+#=====================
+    # Path components from a URL must not lead out of the maps directory
+    for part in parts:
+        if part in ('', '.', '..') or '/' in part or '\\' in part or part.startswith('.'):
+            raise ValueError('Invalid path')
+    return os.path.join(*parts)
+
+#===============================================================================
+
+class TileServer(object):
+    """
+    Serve the maps in a directory.
+
+    MBTiles databases and files are read on a single thread, so each
+    database's connection is opened once and reused.
+    """
+    def __init__(self, maps_dir, cache_size=DEFAULT_CACHE_SIZE*1024*1024):
+        self._maps_dir = maps_dir
+        self._cache = LRUCache(cache_size)
+        self._reader = ThreadPoolExecutor(max_workers=1)
+        self._databases = {}
+        self._request_count = 0
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def maps_dir(self):
+        return self._maps_dir
+
+    @property
+    def request_count(self):
+        return self._request_count
+
+    def close(self):
+        self._reader.submit(self._close_databases).result()
+        self._reader.shutdown()
+
+    def _close_databases(self):
+        for database in self._databases.values():
+            if database is not None:
+                database[0].close()
+        self._databases = {}
+
+    def _database(self, filename):
+        # Opened on the reader thread, where it is always used
+        if filename not in self._databases:
+            if os.path.exists(filename):
+                db = MBTiles(filename, readonly=True)
+                self._databases[filename] = (db, db.metadata().get('format', 'pbf'))
+            else:
+                self._databases[filename] = None
+        return self._databases[filename]
+
+    def _tile(self, filename, zoom, column, row):
+        database = self._database(filename)
+        if database is None:
+            return None
+        (db, format) = database
+        data = db.get_tile(zoom, column, row)
+        if data is None:
+            return None
+        return Resource(data, CONTENT_TYPES.get(format, 'application/octet-stream'),
+                        data[:2] == GZIP_MAGIC)
+
+    def _file(self, filename):
+        content_type = (mimetypes.guess_type(filename)[0]
+                        or CONTENT_TYPES.get(os.path.splitext(filename)[1][1:], 'application/octet-stream'))
+        for (name, gzipped) in [(filename + '.gz', True), (filename, False)]:
+            if os.path.isfile(name):
+                with open(name, 'rb') as resource_file:
+                    return Resource(resource_file.read(), content_type, gzipped)
+        return None
+
+    def _load(self, path):
+        """
+        Read the resource for a URL path, returning None if there is none.
+        """
+        parts = path.strip('/').split('/')
+        try:
+            if len(parts) == 1 or len(parts) == 2 and parts[1] == 'index.json':
+                return self._file(os.path.join(self._maps_dir, safe_path(parts[0], 'index.json')))
+            elif len(parts) == 5 and parts[1] == 'mvtiles':
+                (zoom, column, row) = (int(p) for p in parts[2:])
+                return self._tile(os.path.join(self._maps_dir, safe_path(parts[0], 'index.mbtiles')),
+                                  zoom, column, flip_row(zoom, row))
+            elif len(parts) == 6 and parts[1] == 'tiles':
+                (zoom, column, row) = (int(p) for p in parts[3:])
+                tiles_dir = os.path.join(self._maps_dir, safe_path(parts[0], 'tiles'))
+                resource = self._tile(os.path.join(tiles_dir, '{}.mbtiles'.format(safe_path(parts[2]))),
+                                      zoom, column, row)
+                if resource is None:
+                    for extension in TILE_EXTENSIONS:
+                        resource = self._file(os.path.join(tiles_dir, parts[2], str(zoom), str(column),
+                                                           '{}.{}'.format(row, extension)))
+                        if resource is not None:
+                            break
+                return resource
+            elif len(parts) == 3 and parts[1] == 'images':
+                return self._file(os.path.join(self._maps_dir, safe_path(parts[0], 'images', parts[2])))
+        except ValueError:
+            pass
+        return None
+
+    async def respond(self, method, target, headers):
+        """
+        The complete HTTP response to a request.
+        """
+        self._request_count += 1
+        if method not in ('GET', 'HEAD'):
+            return http_response(HTTPStatus.METHOD_NOT_ALLOWED, {'Allow': 'GET, HEAD'})
+        head = (method == 'HEAD')
+        path = unquote(urlsplit(target).path)
+        resource = self._cache.get(path)
+        if resource is None:
+            resource = await asyncio.get_running_loop().run_in_executor(self._reader, self._load, path)
+            if resource is None:
+                return http_response(HTTPStatus.NOT_FOUND, head=head)
+            self._cache.put(path, resource, len(resource))
+        encoded = resource.gzipped and 'gzip' in headers.get('accept-encoding', '')
+        response_headers = {
+            'Content-Type': resource.content_type,
+            'ETag': resource.etag(encoded),
+            'Vary': 'Accept-Encoding',
+            'Cache-Control': 'no-cache'
+        }
+        if encoded:
+            response_headers['Content-Encoding'] = 'gzip'
+        if response_headers['ETag'] in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+            return http_response(HTTPStatus.NOT_MODIFIED, response_headers, head=True)
+        body = resource.data
+        if resource.gzipped and not encoded:
+            body = gzip.decompress(body)
+        return http_response(HTTPStatus.OK, response_headers, body, head)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    (method, target, version) = request_line.decode('latin-1').split()
+                except ValueError:
+                    writer.write(http_response(HTTPStatus.BAD_REQUEST, {'Connection': 'close'}))
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    (name, _, value) = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if 'content-length' in headers:
+                    await reader.readexactly(int(headers['content-length']))
+                connection = headers.get('connection', '').lower()
+                keep_alive = (connection != 'close' if version == 'HTTP/1.1'
+                              else connection == 'keep-alive')
+                writer.write(await self.respond(method, target, headers))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host, port):
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+#===============================================================================
+
+async def fetch(reader, writer, path):
+#=====================================
+    """
+    Make a request on a kept alive connection, returning the response's
+    status and body.
+    """
+    writer.write('GET {} HTTP/1.1\r\nHost: localhost\r\nAccept-Encoding: gzip\r\n\r\n'
+                 .format(path).encode('latin-1'))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        (name, _, value) = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return (status, await reader.readexactly(length))
+
+async def benchmark(server, host, port, map_id, requests, concurrency):
+#======================================================================
+    """
+    Request a map's vector tiles, chosen at random, from concurrent clients
+    and report throughput and latency.
+    """
+    filename = os.path.join(server.maps_dir, safe_path(map_id, 'index.mbtiles'))
+    with MBTiles(filename, readonly=True) as db:
+        tiles = ['/{}/mvtiles/{}/{}/{}'.format(map_id, z, x, flip_row(z, y))
+                    for (z, x, y, data) in db.tiles()]
+    if not tiles:
+        raise ValueError('Map {} has no tiles'.format(map_id))
+    random.seed(0)
+    paths = [random.choice(tiles) for _ in range(requests)]
+    latencies = []
+    total_bytes = 0
+    async def client(paths):
+        nonlocal total_bytes
+        (reader, writer) = await asyncio.open_connection(host, port)
+        try:
+            for path in paths:
+                start_time = time.perf_counter()
+                (status, body) = await fetch(reader, writer, path)
+                latencies.append(time.perf_counter() - start_time)
+                total_bytes += len(body)
+        finally:
+            writer.close()
+    start_time = time.perf_counter()
+    await asyncio.gather(*[client(paths[n::concurrency]) for n in range(concurrency)])
+    elapsed = time.perf_counter() - start_time
+    latencies.sort()
+    def percentile(p):
+        return 1000*latencies[min(len(latencies) - 1, int(p*len(latencies)))]
+    cache = server.cache
+    print('{} requests from {} clients in {:.2f}s: {:.0f} requests/s, {:.1f} MB/s'
+          .format(len(latencies), concurrency, elapsed, len(latencies)/elapsed,
+                  total_bytes/(1024*1024*elapsed)))
+    print('Latency: p50 {:.2f} ms, p95 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms'
+          .format(percentile(0.50), percentile(0.95), percentile(0.99), 1000*latencies[-1]))
+    print('Cache: {:.0%} hits, {} entries, {:.1f} MB'
+          .format(cache.hits/max(1, cache.hits + cache.misses), len(cache), cache.bytes/(1024*1024)))
+
+#===============================================================================
+
+async def serve(args):
+#=====================
+    server = TileServer(args.maps_dir, args.cache_size*1024*1024)
+    http_server = await server.start(args.host, args.port)
+    try:
+        if args.benchmark is not None:
+            port = http_server.sockets[0].getsockname()[1]
+            await benchmark(server, args.host, port, args.benchmark, args.requests, args.concurrency)
+        else:
+            print('Serving {} at http://{}:{}/'.format(args.maps_dir, args.host, args.port))
+            await http_server.serve_forever()
+    finally:
+        http_server.close()
+        await http_server.wait_closed()
+        server.close()
+
+#===============================================================================
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve flatmap styles, tiles and images.')
+    parser.add_argument('--benchmark', metavar='MAP_ID',
+                        help="load test the server with requests for a map's vector tiles, then exit")
+    parser.add_argument('--cache-size', type=int, metavar='MB', default=DEFAULT_CACHE_SIZE,
+                        help='maximum size of cached responses (default {} MB)'.format(DEFAULT_CACHE_SIZE))
+    parser.add_argument('--concurrency', type=int, metavar='N', default=16,
+                        help='number of concurrent benchmark clients (default 16)')
+    parser.add_argument('--host', default='localhost',
+                        help='address to listen on (default `localhost`)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help='port to listen on (default {}); 0 chooses a free port'.format(DEFAULT_PORT))
+    parser.add_argument('--requests', type=int, metavar='N', default=10000,
+                        help='number of benchmark requests (default 10000)')
+    parser.add_argument('maps_dir', metavar='MAPS_DIRECTORY',
+                        help='the directory containing map directories')
+
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+#===============================================================================
@@ -41,22 +41,54 @@ Algorithm:
 """
 #===============================================================================
 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import importlib.util
+import io
+import json
 import math
+from multiprocessing import shared_memory
 import os
+import re
+import shutil
+import time
+import xml.etree.ElementTree as ElementTree
 
 #===============================================================================
 
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageColor
 
 Image.MAX_IMAGE_PIXELS = None
 
 #===============================================================================
 
+# MBTiles are read and written by the Python map maker's module. It is loaded
+# from its file, as the map maker's ``src`` is not an installed package
+
+MBTILES_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', 'python', 'src', 'mbtiles.py')
+
+def load_module(name, file_name):
+#================================
+    spec = importlib.util.spec_from_file_location(name, file_name)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+mbtiles = load_module('mbtiles', MBTILES_MODULE)
+
+#===============================================================================
+
 COLOUR_WHITE = (255, 255, 255)
 
 TILE_SIZE    = (256, 256)
 
+TRANSPARENCY_BLOCK_ROWS = 256
+
+LANCZOS_SUPPORT = 3.0
+
 #===============================================================================
 
 def create_directories(file_name):
@@ -68,74 +100,641 @@ def create_directories(file_name):
 
 # Based on https://stackoverflow.com/a/54148416/2159023
 
-def make_transparent(img, colour):
-    x = np.asarray(img.convert('RGBA')).copy()
-    if colour == COLOUR_WHITE:
-        x[:, :, 3] = (255 * (x[:, :, :3] != 255).any(axis=2)).astype(np.uint8)
+def colour_key_alpha(pixels, colour, tolerance=0):
+    """
+    Set the alpha of an RGBA array in place, making pixels transparent when
+    each of their channels is within ``tolerance`` of ``colour`` and opaque
+    otherwise.
+    """
+    colour = np.array(tuple(colour)[0:3], dtype=np.int16)
+    if tolerance == 0:
+        matches = (pixels[:, :, 0:3] == colour).all(axis=2)
     else:
-        x[:, :, 3] = (255*(x[:,:,0:3] != tuple(colour)[0:3]).any(axis=2)).astype(np.uint8)
-    return Image.fromarray(x)
+        matches = (np.abs(pixels[:, :, 0:3] - colour) <= tolerance).all(axis=2)
+    pixels[:, :, 3] = np.where(matches, 0, 255)
+
+def make_transparent(img, colour, tolerance=0):
+    """
+    Colour key an image, a block of rows at a time so that only a block's
+    worth of temporary arrays are needed. An RGBA image is modified in place.
+    """
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    for top in range(0, img.height, TRANSPARENCY_BLOCK_ROWS):
+        block = np.array(img.crop((0, top, img.width, min(top + TRANSPARENCY_BLOCK_ROWS, img.height))))
+        colour_key_alpha(block, colour, tolerance)
+        img.paste(Image.fromarray(block, 'RGBA'), (0, top))
+    return img
+
+#===============================================================================
+
+def half_size_box(pixels):
+    """
+    Halve an RGBA array by averaging each 2x2 block of pixels, weighting
+    colours by their alpha.
+    """
+    (height, width) = pixels.shape[:2]
+    pixels = pixels[:height - height % 2, :width - width % 2].astype(np.uint32)
+    alpha = pixels[:, :, 3]
+    premultiplied = pixels[:, :, :3]*alpha[:, :, np.newaxis]
+    alpha_sum = alpha[0::2, 0::2] + alpha[0::2, 1::2] + alpha[1::2, 0::2] + alpha[1::2, 1::2]
+    colour_sum = (premultiplied[0::2, 0::2] + premultiplied[0::2, 1::2]
+                + premultiplied[1::2, 0::2] + premultiplied[1::2, 1::2])
+    half = np.zeros(alpha_sum.shape + (4,), dtype=np.uint8)
+    opaque = alpha_sum > 0
+    half[opaque, :3] = ((colour_sum[opaque] + alpha_sum[opaque, np.newaxis]//2)
+                          //alpha_sum[opaque, np.newaxis])
+    half[:, :, 3] = (alpha_sum + 2)//4
+    return half
+
+def half_size_lanczos(pixels):
+    # PIL premultiplies RGBA by alpha when resampling
+    image = Image.fromarray(pixels, 'RGBA')
+    return np.asarray(image.resize((image.width//2, image.height//2), Image.LANCZOS))
+
+HALF_SIZE_RESAMPLERS = {
+    'box': half_size_box,
+    'lanczos': half_size_lanczos
+}
+
+#===============================================================================
+
+def classify_tiles(pixels, count):
+    """
+    Find which of the first ``count`` tiles in an RGBA band are empty
+    (completely transparent) and which are a single colour.
+
+    Returns boolean arrays of empty and uniform tiles, along with the
+    colour of each tile's first pixel.
+    """
+    width = count*TILE_SIZE[0]
+    if pixels.shape[1] < width:
+        pixels = np.pad(pixels, ((0, 0), (0, width - pixels.shape[1]), (0, 0)))
+    tiles = pixels[:, :width].reshape((pixels.shape[0], count, TILE_SIZE[0], 4))
+    colours = tiles[0, :, 0]
+    empty = ~tiles[:, :, :, 3].any(axis=(0, 2))
+    uniform = (tiles == colours[np.newaxis, :, np.newaxis]).all(axis=(0, 2, 3))
+    return (empty, uniform & ~empty, colours)
+
+#===============================================================================
+
+DEFAULT_COMPRESS_LEVEL = 6
+
+DEFAULT_QUALITY = 80
+
+class TileEncoding(object):
+    """
+    How tiles are encoded. Encodings are passed to worker processes so only
+    hold their settings.
+    """
+    name = None
+    format = None
+
+    def __init__(self, compress_level=DEFAULT_COMPRESS_LEVEL, quality=DEFAULT_QUALITY):
+        self._compress_level = compress_level
+        self._quality = quality
+
+    @property
+    def description(self):
+        return self.name
+
+    @property
+    def options(self):
+        return {'encoding': self.name}
+
+    def encode(self, tile):
+        output = io.BytesIO()
+        self._save(tile, output)
+        return output.getvalue()
+
+    def _save(self, tile, output):
+        # Override in sub-class
+        pass
+
+class PngEncoding(TileEncoding):
+    name = 'png'
+    format = 'png'
+
+    @property
+    def description(self):
+        return '{} (zlib level {})'.format(self.name, self._compress_level)
+
+    @property
+    def options(self):
+        return {'encoding': self.name, 'compress_level': self._compress_level}
+
+    def _save(self, tile, output):
+        tile.save(output, format='PNG', compress_level=self._compress_level)
+
+class PalettePngEncoding(PngEncoding):
+    # Alpha is kept in the palette
+    name = 'png-palette'
+
+    def _save(self, tile, output):
+        tile = tile.quantize(colors=256, method=Image.Quantize.FASTOCTREE)
+        tile.save(output, format='PNG', compress_level=self._compress_level)
+
+class WebpEncoding(TileEncoding):
+    name = 'webp'
+    format = 'webp'
+
+    def _save(self, tile, output):
+        tile.save(output, format='WEBP', lossless=True, exact=False)
+
+class LossyWebpEncoding(TileEncoding):
+    name = 'webp-lossy'
+    format = 'webp'
+
+    @property
+    def description(self):
+        return '{} (quality {})'.format(self.name, self._quality)
+
+    @property
+    def options(self):
+        return {'encoding': self.name, 'quality': self._quality}
+
+    def _save(self, tile, output):
+        tile.save(output, format='WEBP', quality=self._quality)
+
+TILE_ENCODINGS = {encoding.name: encoding
+                    for encoding in [PngEncoding, PalettePngEncoding, WebpEncoding, LossyWebpEncoding]}
+
+#===============================================================================
+
+class TileDirectory(object):
+    """
+    Save a layer's tiles as ``ID/tiles/LAYER/Z/X/Y.png`` files, or with
+    the extension of the encoding's format.
+
+    Existing tiles are updated when tiling is incremental, otherwise they
+    are removed first, as none of them are known to still be current.
+    """
+    def __init__(self, map, layer_name, format='png', incremental=False):
+        self._directory = os.path.join(map.id, 'tiles', layer_name)
+        if os.path.isdir(self._directory) and not incremental:
+            shutil.rmtree(self._directory)
+        self._format = format
+        self._directories = set()
+
+    def _tile_name(self, z, x, y):
+        directory = os.path.join(self._directory, str(z), str(x))
+        if directory not in self._directories:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self._directories.add(directory)
+        tile_name = os.path.join(directory, '{}.{}'.format(y, self._format))
+        # Don't write through a link to a uniform tile from a previous run
+        if os.path.islink(tile_name):
+            os.remove(tile_name)
+        return tile_name
+
+    def save_tile(self, z, x, y, data):
+        with open(self._tile_name(z, x, y), 'wb') as tile_file:
+            tile_file.write(data)
+
+    def save_uniform_tile(self, z, x, y, colour, data):
+        # Tiles of a single colour are links to a shared file
+        shared_name = os.path.join(self._directory, 'uniform',
+                                   '{}.{}'.format(''.join('{:02x}'.format(c) for c in colour),
+                                                  self._format))
+        if shared_name not in self._directories:
+            create_directories(shared_name)
+            with open(shared_name, 'wb') as tile_file:
+                tile_file.write(data)
+            self._directories.add(shared_name)
+        tile_name = self._tile_name(z, x, y)
+        if os.path.exists(tile_name):
+            os.remove(tile_name)
+        os.symlink(os.path.relpath(shared_name, os.path.dirname(tile_name)), tile_name)
+
+    def remove_tile(self, z, x, y):
+        tile_name = os.path.join(self._directory, str(z), str(x), '{}.{}'.format(y, self._format))
+        if os.path.lexists(tile_name):
+            os.remove(tile_name)
+
+    def close(self, zoom_range):
+        pass
+
+#===============================================================================
+
+class MBTilesWriter(object):
+    """
+    Save a layer's tiles into an ``ID/tiles/LAYER.mbtiles`` database, storing
+    identical tiles only once.
+
+    Tiles are inserted in batches within a single transaction, which is
+    committed when the writer is closed. An existing database is updated
+    when tiling is incremental, otherwise it is replaced.
+    """
+    def __init__(self, map, layer_name, format='png', incremental=False):
+        self._layer_name = layer_name
+        self._format = format
+        mbtiles_file = os.path.join(map.id, 'tiles', '{}.mbtiles'.format(layer_name))
+        if os.path.exists(mbtiles_file) and not incremental:
+            os.remove(mbtiles_file)
+        self._db = mbtiles.MBTiles(mbtiles_file, create=True, deduplicate=True)
+        self._tiles = []
+        self._removed_tiles = []
+        self._tile_count = 0
+
+    def save_tile(self, z, x, y, data):
+        # Our tile rows are numbered from the bottom, as are MBTiles' (TMS)
+        self._tiles.append((z, x, y, data))
+        self._tile_count += 1
+        if len(self._tiles) >= mbtiles.BATCH_SIZE:
+            self._db.save_tiles(self._tiles)
+            self._tiles = []
+
+    def save_uniform_tile(self, z, x, y, colour, data):
+        # Identical tiles are already stored once
+        self.save_tile(z, x, y, data)
+
+    def remove_tile(self, z, x, y):
+        self._removed_tiles.append((z, x, y))
+
+    def close(self, zoom_range):
+        self._db.save_tiles(self._tiles)
+        self._db.remove_tiles(self._removed_tiles)
+        self._db.update_metadata([
+            ('name', self._layer_name),
+            ('type', 'overlay'),
+            ('version', '1'),
+            ('format', self._format),
+            ('minzoom', str(min(zoom_range))),
+            ('maxzoom', str(max(zoom_range)))
+        ])
+        self._db.commit()
+        print('Saved {} tiles ({} unique) in {}'.format(self._tile_count, self._db.unique_tile_count(),
+                                                       self._db.filename))
+        self._db.close()
+
+#===============================================================================
+
+class TileManifest(object):
+    """
+    Hashes of the pixels of a layer's tiles when they were last saved, so
+    that tiles which haven't changed are neither encoded nor saved again.
+    """
+    def __init__(self, map, layer_name, options, force=False):
+        self._manifest_file = os.path.join(map.id, 'tiles', '{}.manifest.json'.format(layer_name))
+        self._options = options
+        self._previous = {}
+        self._tiles = {}
+        if not force and os.path.exists(self._manifest_file):
+            with open(self._manifest_file) as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get('options') == options:
+                self._previous = manifest.get('tiles', {})
+
+    @property
+    def incremental(self):
+        return len(self._previous) > 0
+
+    def unchanged(self, z, x, y, pixels):
+        """
+        Record the hash of a tile's pixels, returning True if the tile is as
+        it was last saved.
+        """
+        key = '{}/{}/{}'.format(z, x, y)
+        tile_hash = hashlib.blake2b(np.ascontiguousarray(pixels), digest_size=16).hexdigest()
+        self._tiles[key] = tile_hash
+        return self._previous.get(key) == tile_hash
+
+    def removed(self, zoom_range):
+        # Tiles last saved at these zoom levels that are now empty
+        for key in self._previous:
+            (z, x, y) = (int(n) for n in key.split('/'))
+            if z in zoom_range and key not in self._tiles:
+                yield (z, x, y)
+
+    def save(self, zoom_range):
+        # Keep the hashes of tiles at zoom levels that weren't tiled
+        tiles = {key: tile_hash for (key, tile_hash) in self._previous.items()
+                                 if int(key.split('/')[0]) not in zoom_range}
+        tiles.update(self._tiles)
+        with open(self._manifest_file, 'w') as manifest_file:
+            json.dump({'options': self._options, 'tiles': tiles}, manifest_file)
+
+#===============================================================================
+
+TILE_OUTPUTS = {
+    'files': TileDirectory,
+    'mbtiles': MBTilesWriter
+}
+
+#===============================================================================
+
+def encode_band_tiles(memory_name, shape, columns, encoding):
+    """
+    Encode tiles from a band of tiles in shared memory, returning a list
+    of ``(x, tile_data)`` tuples along with the time spent encoding.
+    """
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        band = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+        tiles = [(x, np.array(band[:, x*TILE_SIZE[0]:(x+1)*TILE_SIZE[0]])) for x in columns]
+        del band
+    finally:
+        memory.close()
+    start_time = time.process_time()
+    encoded = [(x, encoding.encode(Image.fromarray(tile, 'RGBA'))) for (x, tile) in tiles]
+    return (encoded, time.process_time() - start_time)
+
+#===============================================================================
+
+class TileEncoder(object):
+    """
+    Encode tiles band by band, across a pool of processes when there is
+    more than one job. Encoded tiles are saved in the order they were
+    submitted, whatever order they are encoded in.
+
+    Uniform tiles are only encoded once for each colour.
+
+    The bytes of tiles saved, and the processor time spent encoding them,
+    are totalled so that encodings can be compared.
+    """
+    def __init__(self, tile_output, encoding, executor=None, jobs=1):
+        self._tile_output = tile_output
+        self._encoding = encoding
+        self._executor = executor
+        self._jobs = max(1, jobs)
+        self._pending = deque()
+        self._uniform_tiles = {}
+        self._tile_count = 0
+        self._total_bytes = 0
+        self._encode_time = 0.0
+
+    @property
+    def encode_time(self):
+        return self._encode_time
+
+    @property
+    def tile_count(self):
+        return self._tile_count
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    def _encode(self, tile):
+        start_time = time.process_time()
+        data = self._encoding.encode(tile)
+        self._encode_time += time.process_time() - start_time
+        return data
+
+    def _save_tile(self, z, x, y, data):
+        self._tile_output.save_tile(z, x, y, data)
+        self._tile_count += 1
+        self._total_bytes += len(data)
+
+    def _uniform_tile(self, colour):
+        data = self._uniform_tiles.get(colour)
+        if data is None:
+            data = self._encode(Image.new('RGBA', TILE_SIZE, colour))
+            self._uniform_tiles[colour] = data
+        return data
+
+    def _save_uniform_tiles(self, z, y, uniform):
+        for (x, colour) in uniform:
+            data = self._uniform_tile(colour)
+            self._tile_output.save_uniform_tile(z, x, y, colour, data)
+            self._tile_count += 1
+            self._total_bytes += len(data)
+
+    def encode_band(self, band, z, y, columns, uniform=()):
+        """
+        Encode and save the tiles at ``columns`` of a band, along with the
+        ``(x, colour)`` uniform tiles of the band.
+        """
+        if self._executor is None or len(columns) == 0:
+            self._save_uniform_tiles(z, y, uniform)
+            for x in columns:
+                tile = band.crop((x*TILE_SIZE[0], 0, (x+1)*TILE_SIZE[0], TILE_SIZE[1]))
+                self._save_tile(z, x, y, self._encode(tile))
+            return
+        # Bands are padded to whole tiles when copied into shared memory
+        shape = (TILE_SIZE[1], TILE_SIZE[0]*(max(columns) + 1), 4)
+        memory = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)))
+        pixels = np.ndarray(shape, dtype=np.uint8, buffer=memory.buf)
+        pixels[:] = 0
+        width = min(band.width, shape[1])
+        pixels[:, :width] = np.asarray(band.convert('RGBA'))[:, :width]
+        del pixels
+        chunk_size = int(math.ceil(len(columns)/self._jobs))
+        futures = [self._executor.submit(encode_band_tiles, memory.name, shape,
+                                         columns[n:n+chunk_size], self._encoding)
+                      for n in range(0, len(columns), chunk_size)]
+        self._pending.append((memory, z, y, uniform, futures))
+        # Limit the number of bands held in shared memory
+        while len(self._pending) > 2*self._jobs:
+            self._save_band()
+
+    def _save_band(self):
+        (memory, z, y, uniform, futures) = self._pending.popleft()
+        try:
+            self._save_uniform_tiles(z, y, uniform)
+            for future in futures:
+                (encoded, encode_time) = future.result()
+                self._encode_time += encode_time
+                for (x, data) in encoded:
+                    self._save_tile(z, x, y, data)
+        finally:
+            memory.close()
+            memory.unlink()
+
+    def close(self):
+        try:
+            while self._pending:
+                self._save_band()
+        finally:
+            while self._pending:
+                memory = self._pending.popleft()[0]
+                memory.close()
+                memory.unlink()
 
 #===============================================================================
 
 class TileMaker(object):
-    def __init__(self, map):
+    """
+    Tile an image one row of tiles at a time, so that only a band of the
+    scaled image, and a band for each overview level, is ever held in memory.
+
+    Tile rows are numbered from the bottom. Each pair of rows at a zoom level
+    is halved, as a whole, into a single row of the next lower level, which is
+    tiled as soon as both of its halves are present.
+
+    With more than one job, tiles are encoded by a pool of processes that is
+    shared by all the images tiled, until the tile maker is closed.
+    """
+    def __init__(self, map, jobs=1, output_format='files', resample='box', force=False,
+                 encoding=None):
         self._map = map
+        self._encoding = encoding if encoding is not None else PngEncoding()
+        self._output_format = output_format
+        self._resample = resample
+        self._force = force
+        self._jobs = max(1, jobs)
+        self._executor = ProcessPoolExecutor(max_workers=self._jobs) if self._jobs > 1 else None
+        self._TileOutput = TILE_OUTPUTS[output_format]
+        self._half_size = HALF_SIZE_RESAMPLERS[resample]
         self._tiled_size = (int(math.ceil(map.bounds[0]/TILE_SIZE[0])),
                             int(math.ceil(map.bounds[1]/TILE_SIZE[1])))
         self._tiled_image_size = (TILE_SIZE[0]*self._tiled_size[0],
                                   TILE_SIZE[1]*self._tiled_size[1])
-        max_tile_dim = max(self._tiled_size[0], self._tiled_size[1])
-        self._full_zoom = int(math.ceil(math.log(max_tile_dim, 2)))
+        self._full_zoom = map.full_zoom
 
     def make_tiles(self, image, scale=None, offset=None, zoom_range=None):
         if scale is None:
-            scaled_image = image.image
+            scaled_size = image.image.size
         else:
-            scaled_size = [scale[0]*image.width, scale[1]*image.height]
-            scaled_image = image.image.resize(scaled_size, Image.LANCZOS)
-
-        tiled_image = Image.new('RGBA', self._tiled_image_size, (0, 0, 0, 0))
+            scaled_size = (int(round(scale[0]*image.image.width)),
+                           int(round(scale[1]*image.image.height)))
 
         if offset is None:
             offset = [0, 0]
 
-        # PIL origin is top left, map's is bottom right
-        offset[1] = (self._map.bounds[1] - offset[1]) - scaled_image.height
-
-        overview_height = self._map.bounds[1]
-        offset[1] += (self._tiled_image_size[1] - overview_height)
-        tiled_image.paste(scaled_image, offset, scaled_image)
-
-        # Divide tiled_image into TILE_SIZE tiles, only outputting non-transparent
-        # tiles.
-
         if zoom_range is None:
             zoom_range = range(self._full_zoom+1)
+        elif len(zoom_range) == 0 or zoom_range[-1] < 0 or zoom_range[0] > self._full_zoom:
+            raise ValueError('Zoom range {}-{} has no levels between 0 and {}'
+                             .format(zoom_range.start, zoom_range.stop - 1, self._full_zoom))
+
+        # Image sizes, and columns and rows of tiles, at each zoom level
 
-        tiled_size = self._tiled_size
+        self._band_widths = {}
+        self._tiled_sizes = {}
+        self._overview_bands = {}
+        image_sizes = {}
+        (image_size, tiled_size) = (self._tiled_image_size, self._tiled_size)
         for z in range(self._full_zoom, -1, -1):
             if z in zoom_range:
                 print('Tiling zoom level {} ({} x {} tiles)'.format(z, tiled_size[0], tiled_size[1]))
-            overview_image = Image.new('RGBA', (tiled_image.width//2, tiled_image.height//2), (0, 0, 0, 0))
-            overview_size = (int(math.ceil(tiled_size[0]/2)), int(math.ceil(tiled_size[1]/2)))
-            overview_height //= 2
-            left = 0
-            for x in range(tiled_size[0]):
-                lower = tiled_image.height
-                for y in range(tiled_size[1]):   ## y = 0 is lowest tile row
-                    tile = tiled_image.crop((left, lower-TILE_SIZE[1], left+TILE_SIZE[0], lower))
-                    tile_name = os.path.join(self._map.id, 'tiles', image.layer_name, str(z), str(x), '{}.png'.format(y))
-                    if tile.getbbox():
-                        if z in zoom_range:
-                            create_directories(tile_name)
-                            tile.save(tile_name)
-                        half_tile = tile.resize((TILE_SIZE[0]//2, TILE_SIZE[1]//2), Image.LANCZOS)
-                        overview_image.paste(half_tile, (left//2, (lower-TILE_SIZE[1])//2), half_tile)
-                    lower -= TILE_SIZE[1]
-                left += TILE_SIZE[0]
-            tiled_image = overview_image
-            tiled_size = overview_size
+            image_sizes[z] = image_size
+            self._band_widths[z] = image_size[0]
+            self._tiled_sizes[z] = tiled_size
+            image_size = (image_size[0]//2, image_size[1]//2)
+            tiled_size = (int(math.ceil(tiled_size[0]/2)), int(math.ceil(tiled_size[1]/2)))
+
+        # Scale the source directly to the highest requested zoom level and
+        # stop at the lowest, so no work is done for other levels
+
+        self._top_zoom = min(self._full_zoom, max(zoom_range))
+        self._bottom_zoom = max(0, min(zoom_range))
+        factor = 2**(self._full_zoom - self._top_zoom)
+        self._image_size = image_sizes[self._top_zoom]
+        self._scaled_size = (int(round(scaled_size[0]/factor)), int(round(scaled_size[1]/factor)))
+
+        # PIL origin is top left, map's is bottom right
+        self._image_offset = (int(round(offset[0]/factor)),
+                              self._image_size[1] - int(round(offset[1]/factor)) - self._scaled_size[1])
+
+        # Counts of tiles, empty tiles, uniform tiles, uniform colours,
+        # unchanged tiles and encoded tiles at each zoom level
+
+        self._statistics = {z: [0, 0, 0, set(), 0, 0] for z in zoom_range}
+
+        # Tiles are only saved when they have changed since the last time
+        # the layer was tiled with the same settings
+
+        options = {
+            'output_format': self._output_format,
+            'resample': self._resample,
+            'scale': list(scaled_size),
+            'offset': list(offset)
+        }
+        options.update(self._encoding.options)
+        self._manifest = TileManifest(self._map, image.layer_name, options, self._force)
+        tile_output = self._TileOutput(self._map, image.layer_name, self._encoding.format,
+                                       self._manifest.incremental)
+        self._encoder = TileEncoder(tile_output, self._encoding, self._executor, self._jobs)
+        try:
+            for y in range(self._tiled_sizes[self._top_zoom][1]):   ## y = 0 is lowest tile row
+                self._tile_band(zoom_range, self._top_zoom, y, self._scaled_band(image, y))
+        finally:
+            self._encoder.close()
+        for (z, x, y) in self._manifest.removed(zoom_range):
+            tile_output.remove_tile(z, x, y)
+        tile_output.close(zoom_range)
+        self._manifest.save(zoom_range)
+
+        for z in sorted(self._statistics, reverse=True):
+            (count, empty, uniform, colours, unchanged, encoded) = self._statistics[z]
+            if count:
+                print('Zoom level {}: {} tiles, {} empty ({:.0%}), {} uniform in {} colours ({:.0%}), '
+                      '{} unchanged, {} encoded'
+                      .format(z, count, empty, empty/count, uniform, len(colours), uniform/count,
+                              unchanged, encoded))
+        (tile_count, total_bytes) = (self._encoder.tile_count, self._encoder.total_bytes)
+        print('Saved {} tiles as {}: {:.1f} MB ({:.1f} KB/tile), {:.1f}s encoding'
+              .format(tile_count, self._encoding.description, total_bytes/(1024*1024),
+                      total_bytes/(1024*max(1, tile_count)), self._encoder.encode_time))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _scaled_band(self, image, y):
+        """
+        A row of tiles at the highest zoom level being tiled, containing the
+        part of the scaled image that lies within it.
+        """
+        band = Image.new('RGBA', (self._image_size[0], TILE_SIZE[1]), (0, 0, 0, 0))
+        band_top = self._image_size[1] - (y + 1)*TILE_SIZE[1]
+        (left, top) = self._image_offset
+        (width, height) = self._scaled_size
+        first_row = max(band_top, top) - top
+        last_row = min(band_top + TILE_SIZE[1], top + height) - top
+        if first_row < last_row:
+            # Source rows are only made transparent as they are needed
+            source = image.image
+            if self._scaled_size == source.size:
+                rows = image.make_transparent(source.crop((0, first_row, width, last_row)))
+            else:
+                y_scale = source.height/height
+                (source_top, source_bottom) = (first_row*y_scale, last_row*y_scale)
+                # Include the rows under the resampling filter's support
+                margin = int(math.ceil(LANCZOS_SUPPORT*max(1.0, y_scale))) + 1
+                crop_top = max(0, int(math.floor(source_top)) - margin)
+                crop_bottom = min(source.height, int(math.ceil(source_bottom)) + margin)
+                rows = image.make_transparent(source.crop((0, crop_top, source.width, crop_bottom)))
+                rows = rows.resize((width, last_row - first_row), Image.LANCZOS,
+                                   box=(0, source_top - crop_top, source.width, source_bottom - crop_top))
+            band.paste(rows, (left, top + first_row - band_top), rows)
+        return band
+
+    def _tile_band(self, zoom_range, z, y, band):
+        # Only non-transparent tiles are output
+        if z in zoom_range:
+            count = self._tiled_sizes[z][0]
+            pixels = np.asarray(band)
+            (empty, uniform, colours) = classify_tiles(pixels, count)
+            changed = [x for x in range(count)
+                         if not empty[x] and not self._manifest.unchanged(z, x, y,
+                                 pixels[:, x*TILE_SIZE[0]:(x+1)*TILE_SIZE[0]])]
+            columns = [x for x in changed if not uniform[x]]
+            uniform_colours = [(x, tuple(colours[x].tolist())) for x in changed if uniform[x]]
+            self._encoder.encode_band(band, z, y, columns, uniform_colours)
+            statistics = self._statistics[z]
+            statistics[0] += count
+            statistics[1] += int(empty.sum())
+            statistics[2] += int(uniform.sum())
+            statistics[3].update(tuple(colours[x].tolist()) for x in range(count) if uniform[x])
+            statistics[4] += count - int(empty.sum()) - len(changed)
+            statistics[5] += len(columns)
+        if z > self._bottom_zoom:
+            overview = self._overview_bands.get(z - 1)
+            if overview is None:
+                overview = np.zeros((TILE_SIZE[1], self._band_widths[z - 1], 4), dtype=np.uint8)
+                self._overview_bands[z - 1] = overview
+            # Even rows are the lower half of an overview row
+            overview_top = TILE_SIZE[1]//2 if y % 2 == 0 else 0
+            half = self._half_size(np.asarray(band))
+            width = min(half.shape[1], overview.shape[1])
+            overview[overview_top:overview_top + half.shape[0], :width] = half[:, :width]
+            if y % 2 == 1 or y == self._tiled_sizes[z][1] - 1:
+                del self._overview_bands[z - 1]
+                self._tile_band(zoom_range, z - 1, y//2, Image.fromarray(overview, 'RGBA'))
 
 #===============================================================================
 
@@ -148,6 +747,13 @@ class Map(object):
     def bounds(self):
         return self._bounds
 
+    @property
+    def full_zoom(self):
+        # The zoom level at which the map is at its full size
+        max_tile_dim = max(int(math.ceil(self._bounds[0]/TILE_SIZE[0])),
+                           int(math.ceil(self._bounds[1]/TILE_SIZE[1])))
+        return int(math.ceil(math.log(max_tile_dim, 2)))
+
     @property
     def id(self):
         return self._id
@@ -155,31 +761,157 @@ class Map(object):
 #===============================================================================
 
 class ImageSource(object):
-    def __init__(self, layer_name, file_name, transparent_colour=None):
+    def __init__(self, layer_name, file_name, transparent_colour=None, tolerance=0, crop=None):
         self._layer_name = layer_name
         self._image = Image.open(file_name)
-        if transparent_colour is not None:
-            self._image = make_transparent(self._image, transparent_colour)
+        if crop is not None:
+            self._image = self._image.crop(crop)
+        self._transparent_colour = transparent_colour
+        self._tolerance = tolerance
 
     @property
     def image(self):
         return self._image
 
+    def make_transparent(self, image):
+        """
+        Make part of the source image transparent, when the source has a
+        transparent colour.
+        """
+        if self._transparent_colour is None:
+            return image
+        return make_transparent(image, self._transparent_colour, self._tolerance)
+
     @property
     def layer_name(self):
         return self._layer_name
 
 #===============================================================================
 
+def tile_encoding(args):
+    return TILE_ENCODINGS[args.encoding](args.compress_level, args.quality)
+
+def zoom_levels(zoom, full_zoom):
+    """
+    The zoom levels to tile, from a ``[MIN, MAX]`` range of levels, or all
+    levels up to ``full_zoom`` if there is no range.
+    """
+    if zoom is None:
+        return range(full_zoom+1)
+    levels = range(int(zoom[0]), int(zoom[1])+1)
+    if len(levels) == 0 or levels[-1] < 0 or levels[0] > full_zoom:
+        raise ValueError('zoom levels {}-{} are not between 0 and {}'
+                         .format(zoom[0], zoom[1], full_zoom))
+    return levels
+
 def main(args):
     map = Map(args.map[0], [int(a) for a in args.map[1:]])
-    tm = TileMaker(map)
+    zoom_range = zoom_levels(args.zoom, map.full_zoom)
+    tm = TileMaker(map, args.jobs, args.output_format, args.resample, args.force,
+                   tile_encoding(args))
     image = ImageSource(args.layer[0], args.layer[1],
-                        COLOUR_WHITE if args.transparent else None)
-    tm.make_tiles(image,
-        scale=[float(s) for s in args.scale] if args.scale else None,
-        offset=[int(o) for o in args.offset] if args.offset else None,
-        zoom_range=range(int(args.zoom[0]), int(args.zoom[1])+1) if args.zoom else None)
+                        COLOUR_WHITE if args.transparent else None, args.tolerance)
+    try:
+        tm.make_tiles(image,
+            scale=[float(s) for s in args.scale] if args.scale else None,
+            offset=[int(o) for o in args.offset] if args.offset else None,
+            zoom_range=zoom_range)
+    finally:
+        tm.close()
+
+#===============================================================================
+
+def svg_size(file_name):
+    """
+    The width and height of an SVG file, in its own units, from its root
+    element's ``width`` and ``height`` or, failing these, its ``viewBox``.
+    """
+    for (event, element) in ElementTree.iterparse(file_name, events=['start']):
+        size = [re.fullmatch(r'\s*([0-9.]+)\s*(px)?\s*', element.get(a, '')) for a in ['width', 'height']]
+        if all(size):
+            return (float(size[0].group(1)), float(size[1].group(1)))
+        view_box = element.get('viewBox', '').replace(',', ' ').split()
+        if len(view_box) == 4:
+            return (float(view_box[2]), float(view_box[3]))
+        return None
+
+def layer_placement(layer, map_size, image_size, source_size):
+    """
+    Where a layer's image is on the map, as ``(crop, scale, offset)``, with
+    ``crop`` the box of the image to tile, or None for all of it.
+
+    This follows ``tilemaker.js``: an image is a rendering of the layer's
+    source, of ``source_size`` in source units. The part of it within the
+    layer's ``sourceExtent`` covers ``resolution`` map units per source unit,
+    or else the whole map, with its bottom left corner at ``origin``.
+    """
+    if 'sourceExtent' in layer or 'resolution' in layer:
+        if source_size is None:
+            raise ValueError('no SVG source to measure its sourceExtent or resolution against')
+        (x, y, width, height) = layer.get('sourceExtent', [0, 0, source_size[0], source_size[1]])
+        (x_scale, y_scale) = (image_size[0]/source_size[0], image_size[1]/source_size[1])
+        crop = (int(round(x*x_scale)), int(round(y*y_scale)),
+                int(round((x + width)*x_scale)), int(round((y + height)*y_scale)))
+        cropped_size = (crop[2] - crop[0], crop[3] - crop[1])
+        if cropped_size[0] <= 0 or cropped_size[1] <= 0:
+            raise ValueError('its sourceExtent is empty')
+        if 'sourceExtent' not in layer:
+            crop = None
+    else:
+        (crop, cropped_size) = (None, image_size)
+    resolution = layer.get('resolution')
+    placed_size = ([resolution*width, resolution*height] if resolution is not None
+                   else map_size)
+    scale = [placed_size[0]/cropped_size[0], placed_size[1]/cropped_size[1]]
+    offset = [int(o) for o in layer['origin']] if 'origin' in layer else None
+    return (crop, scale, offset)
+
+def batch(args):
+    """
+    Tile all the layers of a map specified by a ``mapmaker.json`` file, using
+    each layer's image in the specification's ``images`` directory. An image
+    is a rendering of the layer's SVG source, ``svg/ID.svg`` unless the layer
+    names its ``source``, and is placed on the map by the layer's
+    ``sourceExtent``, ``resolution`` and ``origin``.
+    """
+    with open(os.path.join(args.batch, 'mapmaker.json')) as specification_file:
+        specification = json.load(specification_file)
+    map = Map(specification['id'], specification['size'])
+    tm = TileMaker(map, args.jobs, args.output_format, args.resample, args.force,
+                   tile_encoding(args))
+    start_time = time.time()
+    tiled = 0
+    try:
+        layers = specification['layers']
+        for (n, layer) in enumerate(layers):
+            image_file = os.path.join(args.batch, 'images', '{}.png'.format(layer['id']))
+            if not os.path.exists(image_file):
+                print("Layer {} ({}/{}): no image '{}', skipped".format(layer['id'], n+1, len(layers), image_file))
+                continue
+            source_file = os.path.join(args.batch, layer.get('source', os.path.join('svg', '{}.svg'.format(layer['id']))))
+            source_size = svg_size(source_file) if os.path.exists(source_file) else None
+            with Image.open(image_file) as image:
+                image_size = image.size
+            try:
+                (crop, scale, offset) = layer_placement(layer, map.bounds, image_size, source_size)
+                zoom_range = zoom_levels(layer.get('zoom', args.zoom), map.full_zoom)
+            except ValueError as error:
+                # Rather than make tiles in the wrong place, or none at all
+                print('Layer {} ({}/{}): {}, skipped'.format(layer['id'], n+1, len(layers), error))
+                continue
+            print('Layer {} ({}/{}): tiling {}...'.format(layer['id'], n+1, len(layers), image_file))
+            layer_start = time.time()
+            transparent = layer.get('transparent')
+            image = ImageSource(layer['id'], image_file,
+                                ImageColor.getrgb(transparent) if transparent else None,
+                                args.tolerance, crop)
+            tm.make_tiles(image, scale=scale, offset=offset, zoom_range=zoom_range)
+            print('Layer {} ({}/{}): tiled in {:.1f}s'.format(layer['id'], n+1, len(layers),
+                                                             time.time() - layer_start))
+            tiled += 1
+    finally:
+        tm.close()
+    print('Tiled {} of {} layers in {:.1f}s'.format(tiled, len(specification['layers']), time.time() - start_time))
 
 #===============================================================================
 
@@ -187,19 +919,53 @@ if __name__ == '__main__':
     import argparse
 
     parser = argparse.ArgumentParser(description='Generate tiles for a Flatmap.')
-    parser.add_argument('--map', required=True, nargs=3, metavar=('ID', 'WIDTH', 'HEIGHT'),
-                        help='REQUIRED: the map to generate tiles for. Size is in map pixel units.')
-    parser.add_argument('--layer', required=True, nargs=2, metavar=('ID', 'SOURCE_PNG'),
-                        help='REQUIRED: image to tile for a single map layer.')
+    parser.add_argument('--batch', metavar='SPECIFICATION_DIRECTORY',
+                        help="Tile all layers of the map specified by the directory's `mapmaker.json` file.")
+    parser.add_argument('--compress-level', type=int, choices=range(10), metavar='LEVEL',
+                        default=DEFAULT_COMPRESS_LEVEL,
+                        help='The zlib compression level, 0 to 9, of PNG tiles (default {}).'
+                             .format(DEFAULT_COMPRESS_LEVEL))
+    parser.add_argument('--encoding', choices=list(TILE_ENCODINGS), default='png',
+                        help='How tiles are encoded: as PNG, palette PNG, lossless WebP or lossy WebP (default `png`).')
+    parser.add_argument('--force', action='store_true',
+                        help='Save all tiles, even those unchanged since the layer was last tiled.')
+    parser.add_argument('--map', nargs=3, metavar=('ID', 'WIDTH', 'HEIGHT'),
+                        help='REQUIRED unless --batch: the map to generate tiles for. Size is in map pixel units.')
+    parser.add_argument('--jobs', type=int, metavar='N', default=os.cpu_count(),
+                        help='Number of processes to encode tiles with (default {}).'
+                             .format(os.cpu_count()))
+    parser.add_argument('--layer', nargs=2, metavar=('ID', 'SOURCE_PNG'),
+                        help='REQUIRED unless --batch: image to tile for a single map layer.')
+    parser.add_argument('--output-format', choices=list(TILE_OUTPUTS), default='files',
+                        help='Save tiles as PNG files or in an MBTiles database (default `files`).')
     parser.add_argument('--offset', nargs=2, metavar=('BOTTOM', 'RIGHT'),
                         help='Bottom right corner of image in map pixel units.')
+    parser.add_argument('--quality', type=int, metavar='PERCENT', default=DEFAULT_QUALITY,
+                        help='Quality of lossy WebP tiles (default {}).'.format(DEFAULT_QUALITY))
+    parser.add_argument('--resample', choices=list(HALF_SIZE_RESAMPLERS), default='box',
+                        help='How overview levels are reduced in size (default `box`).')
     parser.add_argument('--scale', nargs=2, metavar=('X-SIZE', 'Y-SIZE'),
                         help='Size of an image pixel in terms of a map pixel unit.')
+    parser.add_argument('--tolerance', type=int, default=0, metavar='LEVELS',
+                        help='Also make colours within this many levels of white transparent.')
     parser.add_argument('--transparent', action='store_true', help='Make white in image transparent.')
-    parser.add_argument('--zoom', nargs=2, metavar=('MIN-LEVEL', 'MAX-LEVEL'),
+    parser.add_argument('--zoom', nargs=2, type=int, metavar=('MIN-LEVEL', 'MAX-LEVEL'),
                         help='Range of zoom levels to generate tiles for.')
 
     args = parser.parse_args()
-    main(args)
+    if args.zoom is not None and args.zoom[0] > args.zoom[1]:
+        parser.error('--zoom MIN-LEVEL must not be greater than MAX-LEVEL')
+    if args.batch is not None:
+        batch(args)
+    elif args.map is None or args.layer is None:
+        parser.error('--map and --layer are required unless --batch is given')
+    else:
+        if args.zoom is not None:
+            map_size = [int(a) for a in args.map[1:]]
+            try:
+                zoom_levels(args.zoom, Map(args.map[0], map_size).full_zoom)
+            except ValueError as error:
+                parser.error(str(error))
+        main(args)
 
 #===============================================================================
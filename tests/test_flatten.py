@@ -0,0 +1,79 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+
+import numpy as np
+import pytest
+
+#===============================================================================
+
+from src.drawml.flatten import flatten_cubics, quadratic_to_cubic
+
+#===============================================================================
+
+def cubic_points(curve, count=1001):
+#===================================
+    t = np.linspace(0.0, 1.0, count)[:, np.newaxis]
+    (p0, p1, p2, p3) = np.asarray(curve, dtype=np.float64)
+    return (1 - t)**3*p0 + 3*(1 - t)**2*t*p1 + 3*(1 - t)*t**2*p2 + t**3*p3
+
+def distance_to_polyline(points, polyline):
+#==========================================
+    (a, b) = (polyline[:-1], polyline[1:])
+    ab = b - a
+    length2 = np.maximum((ab**2).sum(axis=1), 1e-300)
+    t = np.clip(((points[:, np.newaxis] - a)*ab).sum(axis=2)/length2, 0.0, 1.0)
+    nearest = a + t[:, :, np.newaxis]*ab
+    return np.sqrt(((points[:, np.newaxis] - nearest)**2).sum(axis=2)).min(axis=1)
+
+CURVES = [
+    [(0, 0), (0, 1000), (1000, 1000), (1000, 0)],
+    [(0, 0), (3000, 500), (-2000, 500), (1000, 0)],       # Self-intersecting
+    [(0, 0), (100, 0), (200, 0), (300, 0)],                # Straight
+    [(50, 50), (50, 50), (50, 50), (50, 50)],              # A point
+    quadratic_to_cubic((0, 0), (5000, 10000), (10000, 0)),
+]
+
+#===============================================================================
+
+@pytest.mark.parametrize('tolerance', [0.5, 5.0, 50.0])
+def test_flattened_curves_are_within_tolerance(tolerance):
+    polylines = flatten_cubics(CURVES, tolerance)
+    assert len(polylines) == len(CURVES)
+    for (curve, polyline) in zip(CURVES, polylines):
+        assert tuple(polyline[0]) == tuple(curve[0])
+        assert tuple(polyline[-1]) == tuple(curve[-1])
+        assert distance_to_polyline(cubic_points(curve), polyline).max() <= tolerance
+
+def test_straight_curves_are_not_divided():
+    [line, point] = flatten_cubics(CURVES[2:4], 0.01)
+    assert len(line) == 2 and len(point) == 2
+
+def test_tolerance_sets_point_count():
+    counts = [len(flatten_cubics(CURVES[:1], tolerance)[0]) for tolerance in [100.0, 10.0, 1.0, 0.1]]
+    assert counts == sorted(counts) and counts[0] < counts[-1]
+    # The error of a piece falls with the square of its length, so a hundredth
+    # of the tolerance needs around ten times as many points
+    assert counts[-1] < 20*counts[1]
+
+def test_no_curves():
+    assert flatten_cubics([], 1.0) == []
+
+#===============================================================================
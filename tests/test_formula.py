@@ -0,0 +1,91 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+
+from pptx import Presentation
+from pptx.enum.shapes import MSO_SHAPE
+from pptx.util import Emu
+import pytest
+
+#===============================================================================
+
+from src.drawml.formula import compile_guides, Evaluator, Geometry, PRESET_VARIABLES
+from src.drawml.presets import Shapes
+
+#===============================================================================
+
+def evaluate(guides, values=None):
+#=================================
+    values = dict(values or {})
+    for (name, closure) in compile_guides(guides):
+        values[name] = closure(values)
+    return values
+
+def add_shape(preset, width, height):
+#====================================
+    presentation = Presentation()
+    slide = presentation.slides.add_slide(presentation.slide_layouts[6])
+    return slide.shapes.add_shape(preset, 0, 0, Emu(width), Emu(height))
+
+#===============================================================================
+
+def test_redefined_guides():
+    values = evaluate([('a', 'val 1'), ('b', '+- a 1 0'), ('a', '+- b 1 0'), ('c', '*/ a 2 1')])
+    assert (values['a'], values['b'], values['c']) == (3.0, 2.0, 6.0)
+
+def test_redefinition_follows_earlier_readers():
+    # `b` refers forward to the first `a`, so must come before `a` is redefined
+    values = evaluate([('b', '+- a 1 0'), ('a', 'val 1'), ('a', 'val 10')])
+    assert (values['a'], values['b']) == (10.0, 2.0)
+
+def test_forward_references():
+    values = evaluate([('y', '*/ x 2 1'), ('x', 'val w')], {'w': 5.0})
+    assert values['y'] == 10.0
+
+def test_circular_references():
+    with pytest.raises(ValueError):
+        compile_guides([('x', 'val y'), ('y', 'val x')])
+
+#===============================================================================
+
+@pytest.mark.parametrize('preset, name', [(MSO_SHAPE.GEAR_6, 'gear6'),
+                                          (MSO_SHAPE.GEAR_9, 'gear9')])
+def test_preset_guides_in_document_order(preset, name):
+    (width, height) = (1000000, 800000)
+    geometry = Geometry(add_shape(preset, width, height))
+    # Guides evaluated one by one, as they are listed in the definition
+    values = {'w': float(width), 'h': float(height)}
+    for (variable, formula) in PRESET_VARIABLES.items():
+        values[variable] = Evaluator.evaluate(str(formula), values)
+    definition = Shapes.lookup(name)
+    names = set()
+    first_values = {}
+    for gd in list(definition.avLst) + list(definition.gdLst):
+        values[gd.name] = Evaluator.evaluate(gd.fmla, values)
+        first_values.setdefault(gd.name, values[gd.name])
+        names.add(gd.name)
+    assert len(names) < len(definition.avLst) + len(definition.gdLst)
+    for guide in names:
+        assert geometry.evaluate(guide) == pytest.approx(values[guide])
+    # `th` uses the first, pinned, value of `a1`
+    assert geometry.evaluate('a1') != pytest.approx(first_values['a1'])
+    assert geometry.evaluate('th') == pytest.approx(min(width, height)*first_values['a1']/100000)
+
+#===============================================================================
@@ -0,0 +1,103 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+
+import io
+import json
+
+import numpy as np
+
+#===============================================================================
+
+from src.drawml.geometry import Feature, GeometryStore
+from src.drawml.geojson_extractor import write_geojson_seq
+
+#===============================================================================
+
+SQUARE = [[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0], [0.0, 0.0]]
+HOLE = [[0.25, 0.25], [0.75, 0.25], [0.75, 0.75], [0.25, 0.25]]
+LINES = [[[2.0, 2.0], [3.0, 3.0]], [[4.0, 4.0], [5.0, 5.0], [6.0, 4.0]]]
+
+def make_store():
+#================
+    store = GeometryStore()
+    store.add_feature('square', {'name': 'square'}, 'Polygon', [SQUARE, HOLE],
+                      bbox=[0.0, 0.0, 1.0, 1.0])
+    store.add_feature('lines', {}, 'LineString', LINES, min_zoom=2)
+    return store
+
+def part_lists(store, feature):
+#==============================
+    return [part.tolist() for part in store.parts(feature)]
+
+#===============================================================================
+
+def test_features_and_coordinates():
+    store = make_store()
+    (square, lines) = list(store)
+    assert len(store) == 2
+    assert (square.first_part, square.part_count, list(lines.parts)) == (0, 2, [2, 3])
+    assert lines.min_zoom == 2 and lines.max_zoom is None
+    assert store.offsets == [0, 5, 9, 11, 14]
+    coordinates = store.coordinates
+    assert coordinates.shape == (14, 2) and coordinates.dtype == np.float64
+    assert coordinates[9:11].tolist() == LINES[0]
+
+def test_parts_before_and_after_joining():
+    store = make_store()
+    (square, lines) = list(store)
+    # Parts are read from the chunks they were added in
+    assert part_lists(store, square) == [SQUARE, HOLE]
+    assert part_lists(store, lines) == LINES
+    # Reading the coordinates joins the chunks
+    assert len(store.coordinates) == 14
+    assert part_lists(store, square) == [SQUARE, HOLE]
+    assert part_lists(store, lines) == LINES
+    # A mix of joined and pending parts
+    extra = store.add_feature('extra', {}, 'LineString', [[[7.0, 7.0], [8.0, 8.0]]])
+    assert part_lists(store, lines) == LINES
+    assert part_lists(store, extra) == [[[7.0, 7.0], [8.0, 8.0]]]
+    assert len(store.coordinates) == 16
+
+def test_replace_features():
+    store = make_store()
+    (square, lines) = list(store)
+    # A simplified copy of the square's outline, with its parts added to the store
+    first_part = store.add_parts([np.array(SQUARE)[[0, 2, 4]]])
+    simplified = Feature(square.id, square.properties, square.geometry_type, first_part, 1,
+                         max_zoom=4)
+    store.replace_features([simplified, lines])
+    assert list(store) == [simplified, lines]
+    assert part_lists(store, simplified) == [[[0.0, 0.0], [1.0, 1.0], [0.0, 0.0]]]
+    assert part_lists(store, square) == [SQUARE, HOLE]
+
+def test_write_geojson_seq():
+    store = make_store()
+    output = io.StringIO()
+    write_geojson_seq(store, output, layer_id='layer')
+    (square, lines) = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert square == {'type': 'Feature', 'id': 'square', 'properties': {'name': 'square'},
+                      'bbox': [0.0, 0.0, 1.0, 1.0],
+                      'geometry': {'type': 'Polygon', 'coordinates': [SQUARE, HOLE]},
+                      'tippecanoe': {'layer': 'layer'}}
+    assert lines['geometry'] == {'type': 'MultiLineString', 'coordinates': LINES}
+    assert lines['tippecanoe'] == {'minzoom': 2, 'layer': 'layer'}
+
+#===============================================================================
@@ -0,0 +1,86 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+
+import os
+
+import pytest
+
+#===============================================================================
+
+from src.mbtiles import MBTiles, flip_row, BATCH_SIZE
+
+#===============================================================================
+
+def test_flip_row():
+    assert flip_row(0, 0) == 0
+    assert [flip_row(2, row) for row in range(4)] == [3, 2, 1, 0]
+    assert flip_row(5, flip_row(5, 11)) == 11
+
+@pytest.mark.parametrize('deduplicate', [False, True])
+def test_tiles_round_trip(tmp_path, deduplicate):
+    filename = str(tmp_path / 'tiles' / 'test.mbtiles')
+    # More tiles than are written in a batch, with many the same
+    tiles = [(z, x, y, b'tile %d' % ((x + y) % 5)) for z in range(6)
+                for x in range(1 << z) for y in range(1 << z)]
+    assert len(tiles) > BATCH_SIZE
+    with MBTiles(filename, create=True, deduplicate=deduplicate) as db:
+        db.update_metadata({'name': 'test', 'format': 'png'})
+        db.update_metadata([('format', 'webp')])
+        db.save_tiles(iter(tiles))
+    assert not os.path.exists(filename + '-wal')
+    with MBTiles(filename, readonly=True) as db:
+        assert db.metadata() == {'name': 'test', 'format': 'webp'}
+        assert list(db.tiles()) == sorted(tiles)
+        assert db.tile_count() == len(tiles)
+        assert db.tile_count(2) == 16
+        assert db.unique_tile_count() == (5 if deduplicate else len(tiles))
+        assert db.get_tile(3, 2, 4) == b'tile 1'
+        assert db.get_tile(3, 8, 0) is None
+        assert list(db.tiles(4, (1, 2, 2, 3))) == [t for t in tiles if t[0] == 4
+                                                   and 1 <= t[1] <= 2 and 2 <= t[2] <= 3]
+
+def test_replaced_and_removed_tiles(tmp_path):
+    filename = str(tmp_path / 'test.mbtiles')
+    with MBTiles(filename, create=True, deduplicate=True) as db:
+        db.save_tiles([(0, 0, 0, b'a'), (1, 0, 0, b'b'), (1, 1, 0, b'b'), (1, 0, 1, b'c')])
+        db.save_tiles([(1, 0, 1, b'b')])
+        db.remove_unused_images()
+        assert db.unique_tile_count() == 2
+        db.remove_tiles([(0, 0, 0)])
+        assert db.unique_tile_count() == 1
+        assert db.get_tile(1, 0, 1) == b'b'
+        assert db.tile_count() == 3
+
+def test_uncommitted_changes_are_discarded(tmp_path):
+    filename = str(tmp_path / 'test.mbtiles')
+    with MBTiles(filename, create=True) as db:
+        db.save_tiles([(0, 0, 0, b'a')])
+    db = MBTiles(filename)
+    db.save_tiles([(1, 0, 0, b'b')])
+    db.close()
+    with MBTiles(filename, readonly=True) as db:
+        assert db.tile_count() == 1
+
+def test_missing_database(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        MBTiles(str(tmp_path / 'missing.mbtiles'))
+
+#===============================================================================
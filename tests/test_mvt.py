@@ -0,0 +1,93 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+
+import json
+
+import numpy as np
+
+#===============================================================================
+
+from src.mbtiles import MBTiles
+from src.mvt import clip_line_to_slab, clip_ring_to_slab, decode_tile, decode_varints
+from src.mvt import encode_varints, VectorTiler, POLYGON, LINESTRING
+
+#===============================================================================
+
+def test_varints_round_trip():
+    values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2**32, 2**63 - 1], dtype=np.uint64)
+    assert (decode_varints(encode_varints(values)) == values).all()
+    assert len(decode_varints(b'')) == 0
+
+def test_clip_ring_to_slab():
+    square = np.array([[0.0, 0.0], [4.0, 0.0], [4.0, 4.0], [0.0, 4.0]])
+    clipped = clip_ring_to_slab(square, 0, 1.0, 3.0)
+    assert sorted(map(tuple, clipped)) == [(1.0, 0.0), (1.0, 4.0), (3.0, 0.0), (3.0, 4.0)]
+    assert len(clip_ring_to_slab(square, 1, 5.0, 6.0)) == 0
+    assert (clip_ring_to_slab(square, 1, -1.0, 5.0) == square).all()
+
+def test_clip_line_to_slab():
+    # In, out and back in again
+    line = np.array([[0.0, 0.0], [2.0, 0.0], [2.0, 4.0], [0.0, 4.0]])
+    parts = clip_line_to_slab(line, 1, -1.0, 1.0) + clip_line_to_slab(line, 1, 3.0, 5.0)
+    assert [p.tolist() for p in parts] == [[[0.0, 0.0], [2.0, 0.0], [2.0, 1.0]],
+                                           [[2.0, 3.0], [2.0, 4.0], [0.0, 4.0]]]
+    assert clip_line_to_slab(line, 0, 3.0, 4.0) == []
+
+#===============================================================================
+
+def test_empty_tiler(tmp_path):
+    tiler = VectorTiler(0, 4)
+    tiler.write('\n')
+    assert tiler.tasks(4) == []
+    metadata = tiler.metadata('empty')
+    assert 'bounds' not in metadata and 'center' not in metadata
+    mbtiles_file = str(tmp_path / 'empty.mbtiles')
+    assert tiler.make_mbtiles(mbtiles_file, 1) == 0
+    with MBTiles(mbtiles_file, readonly=True) as db:
+        assert db.tile_count() == 0
+
+def test_tiles_round_trip(tmp_path):
+    tiler = VectorTiler(0, 2)
+    tiler.write('\n'.join(json.dumps(feature) for feature in [
+        {'id': 1, 'properties': {'name': 'square'}, 'tippecanoe': {'layer': 'shapes'},
+         'geometry': {'type': 'Polygon',
+                      'coordinates': [[[10, 10], [20, 10], [20, 20], [10, 20], [10, 10]]]}},
+        {'id': 2, 'properties': {'name': 'path'}, 'tippecanoe': {'layer': 'paths', 'minzoom': 1},
+         'geometry': {'type': 'LineString', 'coordinates': [[-20, -20], [20, 20]]}}
+    ]))
+    assert [float(b) for b in tiler.metadata('test')['bounds'].split(',')] == \
+        [-20.0, -20.0, 20.0, 20.0]
+    mbtiles_file = str(tmp_path / 'test.mbtiles')
+    tile_count = tiler.make_mbtiles(mbtiles_file, 2)
+    with MBTiles(mbtiles_file, readonly=True) as db:
+        assert db.tile_count() == tile_count
+        layers = decode_tile(db.get_tile(0, 0, 0))
+        assert list(layers) == ['shapes']
+        [(id, properties, geometry_type, vertex_count, size)] = layers['shapes']
+        assert (id, properties, geometry_type) == (1, {'name': 'square'}, POLYGON)
+        # The line crosses all four tiles at zoom 1, and the square only one
+        for (column, row) in [(0, 0), (0, 1), (1, 0), (1, 1)]:
+            layers = decode_tile(db.get_tile(1, column, row))
+            assert [feature[2] for feature in layers['paths']] == [LINESTRING]
+        assert 'shapes' in decode_tile(db.get_tile(1, 1, 1))
+        assert 'shapes' not in decode_tile(db.get_tile(1, 0, 0))
+
+#===============================================================================
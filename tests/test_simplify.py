@@ -0,0 +1,117 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+
+import numpy as np
+import pytest
+
+#===============================================================================
+
+from src.drawml.simplify import shared_vertex_counts, simplify, topology_anchors, zoom_bands
+from src.drawml.simplify import segment_distances
+
+#===============================================================================
+
+def wiggly_line(count=500, seed=0):
+#==================================
+    x = np.linspace(0.0, 100.0, count)
+    y = 10.0*np.sin(x/7.0) + np.random.default_rng(seed).normal(0.0, 0.2, count)
+    return np.column_stack((x, y))
+
+def ends(count):
+#===============
+    anchors = np.zeros(count, dtype=bool)
+    anchors[[0, -1]] = True
+    return anchors
+
+#===============================================================================
+
+def test_douglas_peucker_is_within_tolerance():
+    line = wiggly_line()
+    for tolerance in [0.1, 1.0, 5.0]:
+        kept = simplify(line, tolerance, ends(len(line)))
+        assert kept[0] == 0 and kept[-1] == len(line) - 1
+        # Each removed point is within tolerance of the segment replacing it
+        segments = np.searchsorted(kept, np.arange(len(line)), side='right') - 1
+        segments = np.minimum(segments, len(kept) - 2)
+        distances = segment_distances(line, line[kept[segments]], line[kept[segments + 1]])
+        assert distances.max() <= tolerance
+
+def test_fewer_points_with_greater_tolerance():
+    line = wiggly_line()
+    for method in ['douglas-peucker', 'visvalingam']:
+        counts = [len(simplify(line, tolerance, ends(len(line)), method))
+                    for tolerance in [0.01, 0.1, 1.0, 10.0]]
+        assert counts == sorted(counts, reverse=True) and counts[-1] < counts[0]
+
+def test_straight_lines():
+    line = np.column_stack((np.arange(10.0), 2*np.arange(10.0)))
+    for method in ['douglas-peucker', 'visvalingam']:
+        assert simplify(line, 0.001, ends(len(line)), method).tolist() == [0, 9]
+    assert simplify(line[:2], 1.0, ends(2)).tolist() == [0, 1]
+
+@pytest.mark.parametrize('method', ['douglas-peucker', 'visvalingam'])
+def test_anchors_are_kept(method):
+    line = wiggly_line()
+    anchors = ends(len(line))
+    anchors[[17, 100, 101, 333]] = True
+    kept = simplify(line, 50.0, anchors, method)
+    assert set(np.flatnonzero(anchors)) <= set(kept)
+
+#===============================================================================
+
+def test_shared_edges_stay_shared():
+    # Two rings sharing a wiggly edge, from (100, 0) to (100, 100)
+    edge = np.column_stack((100.0 + np.sin(np.linspace(0.0, 20.0, 101)), np.linspace(0.0, 100.0, 101)))
+    left = np.vstack(([[0.0, 0.0]], edge, [[0.0, 100.0], [0.0, 0.0]]))
+    right = np.vstack(([[200.0, 100.0]], edge[::-1], [[200.0, 0.0], [200.0, 100.0]]))
+    counts = shared_vertex_counts([left, right])
+    assert counts[0].tolist() == [1] + 101*[2] + [1, 1]
+    simplified = []
+    for (ring, shared) in zip([left, right], counts):
+        kept = simplify(ring, 5.0, topology_anchors(shared, True))
+        simplified.append({tuple(point) for point in ring[kept] if tuple(point) in map(tuple, edge)})
+    assert simplified[0] == simplified[1]
+    assert {tuple(edge[0]), tuple(edge[-1])} <= simplified[0]
+
+def test_unshared_vertices():
+    assert shared_vertex_counts([]) == []
+    counts = shared_vertex_counts([np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 0.0]])])
+    assert counts[0].tolist() == [1, 1, 1]
+    assert topology_anchors(counts[0], False).tolist() == [True, False, True]
+
+#===============================================================================
+
+@pytest.mark.parametrize('map_size, max_zoom', [(1.0, 14), (0.001, 14), (0.001, 4), (0.0, 5)])
+def test_zoom_bands_cover_all_levels(map_size, max_zoom):
+    bands = zoom_bands(map_size, max_zoom)
+    assert bands[0][1] == max_zoom and bands[-1][0] == 0
+    for ((bottom, top), (next_bottom, next_top)) in zip(bands, bands[1:]):
+        assert next_top == bottom - 1
+    assert all(top - bottom < 3 for (bottom, top) in bands[:-1])
+
+def test_zoom_bands_below_a_single_tile():
+    # A map a thousandth of the world's width fits in a tile at zoom level 9,
+    # so the band reaching that level extends to level 0
+    assert zoom_bands(0.001, 14) == [(12, 14), (0, 11)]
+    assert zoom_bands(0.0001, 14) == [(0, 14)]
+    assert zoom_bands(0.01, 14) == [(12, 14), (9, 11), (0, 8)]
+
+#===============================================================================
@@ -0,0 +1,102 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+
+import numpy as np
+import pytest
+
+#===============================================================================
+
+from src.spatial_index import SpatialIndex, geometry_bbox
+
+#===============================================================================
+
+def random_boxes(count, seed=0, size=20.0):
+#==========================================
+    generator = np.random.default_rng(seed)
+    corners = generator.uniform(0.0, 1000.0, (count, 2))
+    sizes = generator.exponential(size, (count, 2))
+    return np.column_stack((corners, corners + sizes))
+
+def overlapping(boxes, bbox):
+#============================
+    return set(np.flatnonzero((boxes[:, 0] <= bbox[2]) & (boxes[:, 2] >= bbox[0])
+                            & (boxes[:, 1] <= bbox[3]) & (boxes[:, 3] >= bbox[1])).tolist())
+
+#===============================================================================
+
+@pytest.mark.parametrize('count, node_size', [(1, 16), (15, 4), (1000, 16), (5000, 9)])
+def test_query_bbox_matches_brute_force(count, node_size):
+    boxes = random_boxes(count)
+    index = SpatialIndex(boxes, node_size=node_size)
+    assert len(index) == count
+    for bbox in random_boxes(200, seed=1, size=100.0):
+        assert set(index.query_bbox(bbox)) == overlapping(boxes, bbox)
+
+def test_query_point():
+    boxes = random_boxes(2000)
+    index = SpatialIndex(boxes, ['feature-{}'.format(n) for n in range(len(boxes))])
+    for (x, y) in np.random.default_rng(3).uniform(0.0, 1000.0, (200, 2)):
+        expected = {'feature-{}'.format(n) for n in overlapping(boxes, (x, y, x, y))}
+        assert set(index.query_point(x, y)) == expected
+    # Edges and corners are inside a box
+    (x0, y0, x1, y1) = boxes[7]
+    assert 'feature-7' in index.query_point(x0, y1)
+    assert 'feature-7' in index.query_point(x1, (y0 + y1)/2)
+
+def test_bounds():
+    boxes = random_boxes(500)
+    assert SpatialIndex(boxes).bounds == (*boxes[:, :2].min(axis=0), *boxes[:, 2:].max(axis=0))
+
+def test_empty_index():
+    index = SpatialIndex([])
+    assert len(index) == 0 and index.bounds is None
+    assert index.query_bbox((0, 0, 1, 1)) == []
+
+def test_save_and_load(tmp_path):
+    boxes = random_boxes(1000)
+    ids = [(n // 10, n % 10) for n in range(len(boxes))]
+    index = SpatialIndex(boxes, ids)
+    filename = str(tmp_path / 'index.json')
+    index.save(filename)
+    loaded = SpatialIndex.load(filename)
+    for bbox in [(0, 0, 100, 100), (500, 500, 510, 510), (-10, -10, -1, -1)]:
+        assert sorted(loaded.query_bbox(bbox)) == sorted(index.query_bbox(bbox))
+    assert loaded.bounds == index.bounds
+
+def test_ids_must_match_boxes():
+    with pytest.raises(ValueError):
+        SpatialIndex(random_boxes(3), ['a', 'b'])
+
+def test_features():
+    features = [
+        {'id': 'a', 'geometry': {'type': 'Point', 'coordinates': [1.0, 2.0]}},
+        {'id': 'b', 'geometry': {'type': 'Polygon',
+                                 'coordinates': [[[0, 0], [4, 0], [4, 3], [0, 0]]]}},
+        {'id': 'c', 'bbox': [10, 10, 20, 20], 'geometry': {'type': 'Point', 'coordinates': [0, 0]}},
+        {'id': 'd', 'geometry': {'type': 'MultiLineString', 'coordinates': []}}
+    ]
+    assert geometry_bbox(features[1]['geometry']) == (0.0, 0.0, 4.0, 3.0)
+    index = SpatialIndex.from_features(features)
+    assert len(index) == 3
+    assert sorted(index.query_point(1.0, 2.0)) == ['a', 'b']
+    assert index.query_point(15, 15) == ['c']
+
+#===============================================================================
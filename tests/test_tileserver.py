@@ -0,0 +1,103 @@
+#===============================================================================
+#
+#  Flatmap viewer and annotation tools
+#
+#  Copyright (c) 2019  David Brooks
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+#===============================================================================
+
+
+import asyncio
+import gzip
+import os
+
+#===============================================================================
+
+from src.tileserver import LRUCache, TileServer, ENTRY_OVERHEAD
+
+#===============================================================================
+
+def response(server, target, **headers):
+#=======================================
+    raw = asyncio.run(server.respond('GET', target, headers))
+    (head, _, body) = raw.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    fields = dict(line.split(': ', 1) for line in lines[1:])
+    return (status, fields, body)
+
+#===============================================================================
+
+def test_cache_evicts_least_recently_used():
+    cache = LRUCache(3*(100 + ENTRY_OVERHEAD))
+    for key in 'abc':
+        cache.put(key, key, 100)
+    assert cache.get('a') == 'a'
+    cache.put('d', 'd', 100)
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in 'acd'] == ['a', 'c', 'd']
+    assert cache.bytes == 3*(100 + ENTRY_OVERHEAD)
+
+def test_cache_ignores_oversized_values():
+    cache = LRUCache(100)
+    cache.put('a', 'a', 100)
+    assert len(cache) == 0
+    assert cache.get('a') is None
+
+def test_cache_replaces_values():
+    cache = LRUCache(1000)
+    cache.put('a', 1, 10)
+    cache.put('a', 2, 20)
+    assert cache.get('a') == 2
+    assert cache.bytes == 20 + ENTRY_OVERHEAD
+
+#===============================================================================
+
+def test_gzipped_variants_have_their_own_tags(tmp_path):
+    os.makedirs(tmp_path / 'map')
+    style = b'{"version": 8}'
+    with open(tmp_path / 'map' / 'index.json.gz', 'wb') as fp:
+        fp.write(gzip.compress(style))
+    server = TileServer(str(tmp_path))
+    try:
+        (status, encoded, body) = response(server, '/map/', **{'accept-encoding': 'gzip'})
+        assert status == 200 and encoded['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(body) == style
+        (status, plain, body) = response(server, '/map/')
+        assert status == 200 and 'Content-Encoding' not in plain
+        assert body == style
+        assert encoded['ETag'] != plain['ETag']
+
+        (status, fields, _) = response(server, '/map/', **{'if-none-match': plain['ETag']})
+        assert status == 304 and fields['ETag'] == plain['ETag']
+        assert 'Content-Length' not in fields
+        # A tag for one encoding doesn't validate the other
+        (status, _, body) = response(server, '/map/', **{'if-none-match': plain['ETag'],
+                                                         'accept-encoding': 'gzip'})
+        assert status == 200 and gzip.decompress(body) == style
+        (status, _, body) = response(server, '/map/', **{'if-none-match': encoded['ETag']})
+        assert status == 200 and body == style
+    finally:
+        server.close()
+
+def test_missing_resources(tmp_path):
+    server = TileServer(str(tmp_path))
+    try:
+        assert response(server, '/map/index.json')[0] == 404
+        assert response(server, '/../index.json')[0] == 404
+    finally:
+        server.close()
+
+#===============================================================================